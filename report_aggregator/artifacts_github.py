@@ -1,82 +1,247 @@
 """Handle Github artifacts."""
 
+import concurrent.futures
+import hashlib
+import http
+import io
 import logging
+import shutil
+import tarfile
+import tempfile
+import threading
 import zipfile
 from pathlib import Path
+from typing import IO
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import Dict
 from typing import Generator
+from typing import Iterable
 from typing import List
+from typing import NamedTuple
+from typing import Optional
 
 import requests
-from github import Artifact as GArtifact
-from github import WorkflowRun as GWorkflowRun
+from urllib3.util import retry as urllib3_retry
 
 from report_aggregator import consts
+from report_aggregator import rate_limiter
+
+if TYPE_CHECKING:
+    from report_aggregator import github_api
+    from report_aggregator import state_index
 
 LOGGER = logging.getLogger(__name__)
 
+# rate limit responses (429) are retried by the rate limiter
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+_RATE_LIMITER = rate_limiter.RateLimiter()
+
+
+class ArtifactTask(NamedTuple):
+    dest_dir: Path
+    download_url: str
+    is_coverage: bool = False
+    size: int = 0
+    digest: str = ""
+
+
+def get_retry() -> urllib3_retry.Retry:
+    """Return retry configuration with exponential backoff that honours `Retry-After`."""
+    return urllib3_retry.Retry(
+        total=consts.HTTP_RETRIES,
+        backoff_factor=consts.HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=("GET", "HEAD"),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def get_rate_limiter() -> rate_limiter.RateLimiter:
+    """Return rate limiter shared by all Github API requests."""
+    return _RATE_LIMITER
+
+
+def get_session() -> requests.Session:
+    """Return HTTP session shared by all downloads, with Github API requests rate limited."""
+    global _SESSION  # noqa: PLW0603
+
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            adapter = rate_limiter.RateLimitedAdapter(
+                rate_limiter=_RATE_LIMITER,
+                pool_connections=consts.HTTP_POOL_SIZE,
+                pool_maxsize=consts.HTTP_POOL_SIZE,
+                max_retries=get_retry(),
+            )
+            # connections are kept alive, so the TLS handshake is paid only once per host
+            session = requests.Session()
+            session.headers.update(consts.AUTH_HEADERS)
+            session.mount("https://", adapter)
+            _SESSION = session
+
+    return _SESSION
+
 
 def get_run_artifacts(
-    run: GWorkflowRun.WorkflowRun,
-) -> Generator[GArtifact.Artifact, None, None]:
+    api: "github_api.GithubApi", run: Dict[str, Any]
+) -> Generator[Dict[str, Any], None, None]:
     """Return artifacts for a run."""
-    return run.get_artifacts()  # type: ignore
+    return api.get_paginated(url=run["artifacts_url"], key="artifacts")
 
 
 def get_result_artifacts(
-    run_artifacts: List[GArtifact.Artifact],
-) -> Generator[GArtifact.Artifact, None, None]:
+    run_artifacts: List[Dict[str, Any]],
+) -> Generator[Dict[str, Any], None, None]:
     """Return results artifacts for a run."""
-    result_artifacts = (a for a in run_artifacts if a.name.startswith(consts.RESULTS_ARTIFACT_NAME))
+    result_artifacts = (
+        a for a in run_artifacts if a["name"].startswith(consts.RESULTS_ARTIFACT_NAME)
+    )
     return result_artifacts
 
 
 def get_coverage_artifacts(
-    run_artifacts: List[GArtifact.Artifact],
-) -> Generator[GArtifact.Artifact, None, None]:
+    run_artifacts: List[Dict[str, Any]],
+) -> Generator[Dict[str, Any], None, None]:
     """Return coverage artifacts for a run."""
-    result_artifacts = (a for a in run_artifacts if a.name.startswith(consts.COV_ARTIFACT_NAME))
+    result_artifacts = (a for a in run_artifacts if a["name"].startswith(consts.COV_ARTIFACT_NAME))
     return result_artifacts
 
 
-def download_artifact(url: str, dest_file: Path) -> Path:
-    """Download artifact from Github."""
-    if not url.startswith("https://"):
-        err = f"Invalid URL: {url}"
+def get_step_id(artifact_name: str) -> str:
+    """Return step id from results artifact name (e.g. 'allure-results-step1' -> 'step1')."""
+    return artifact_name[len(consts.RESULTS_ARTIFACT_NAME) :].lstrip("-")
+
+
+def get_artifact_task(
+    artifact: Dict[str, Any], dest_dir: Path, is_coverage: bool = False
+) -> ArtifactTask:
+    """Return `ArtifactTask` record for an artifact."""
+    return ArtifactTask(
+        dest_dir=dest_dir,
+        download_url=artifact["archive_download_url"],
+        is_coverage=is_coverage,
+        size=artifact.get("size_in_bytes") or 0,
+        # the digest is not available for older artifacts
+        digest=artifact.get("digest") or "",
+    )
+
+
+def verify_download(file: Path, size: int = 0, digest: str = "") -> None:
+    """Check that downloaded file matches the expected size and digest (e.g. 'sha256:...')."""
+    file_size = file.stat().st_size
+    if size and file_size != size:
+        err = f"Size of '{file}' is {file_size}, expected {size}."
+        raise ValueError(err)
+
+    if not digest:
+        return
+
+    algorithm, __, expected_hexdigest = digest.partition(":")
+    hash_obj = hashlib.new(algorithm)
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_obj.update(chunk)
+    file_hexdigest = hash_obj.hexdigest()
+    if file_hexdigest != expected_hexdigest:
+        err = f"Digest of '{file}' is '{algorithm}:{file_hexdigest}', expected '{digest}'."
         raise ValueError(err)
 
-    with requests.get(
-        url, headers=consts.AUTH_HEADERS, stream=True, allow_redirects=True, timeout=300
+
+def _fetch_part(url: str, part_file: Path) -> None:
+    """Download data to the `.part` file, resuming from its current size."""
+    offset = part_file.stat().st_size if part_file.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with get_session().get(
+        url, headers=headers, stream=True, allow_redirects=True, timeout=consts.HTTP_TIMEOUT
     ) as r:
+        if offset and r.status_code == http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+            # nothing left to download, the data will be verified by the caller
+            return
         r.raise_for_status()
-        with open(dest_file, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):  # noqa: FURB122
+
+        mode = "wb"
+        if offset and r.status_code == http.HTTPStatus.PARTIAL_CONTENT:
+            if not r.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                err = f"Unexpected Content-Range for '{part_file}': {r.headers['Content-Range']}"
+                raise ValueError(err)
+            mode = "ab"
+            LOGGER.info(f"Resuming download of '{part_file}' from byte {offset}")
+
+        with open(part_file, mode) as f:
+            for chunk in r.iter_content(chunk_size=65536):  # noqa: FURB122
                 f.write(chunk)
 
+
+def download_artifact(url: str, dest_file: Path, size: int = 0, digest: str = "") -> Path:
+    """Download artifact from Github, resuming interrupted downloads."""
+    if not url.startswith("https://"):
+        err = f"Invalid URL: {url}"
+        raise ValueError(err)
+
+    # renamed to `dest_file` only once its size and digest were verified
+    part_file = dest_file.with_name(f"{dest_file.name}.part")
+    if size and part_file.exists() and part_file.stat().st_size > size:
+        part_file.unlink()
+
+    # resumed using HTTP Range requests, both on connection errors and on the next run
+    for attempt in range(1, consts.HTTP_RETRIES + 1):
+        if size and part_file.exists() and part_file.stat().st_size == size:
+            break
+        try:
+            _fetch_part(url=url, part_file=part_file)
+        except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+            if attempt == consts.HTTP_RETRIES:
+                raise
+            LOGGER.warning(f"Download of '{part_file}' interrupted, resuming")
+        else:
+            break
+
+    try:
+        verify_download(file=part_file, size=size, digest=digest)
+    except ValueError:
+        # the data are corrupted, start from scratch next time
+        part_file.unlink()
+        raise
+
+    part_file.replace(dest_file)
     return dest_file
 
 
-def _process_artifact(dest_dir: Path, zip_file: Path, download_url: str) -> None:
+def _process_artifact(
+    dest_dir: Path, zip_file: Path, download_url: str, size: int = 0, digest: str = ""
+) -> None:
     zip_file.unlink(missing_ok=True)
     LOGGER.info(f"Downloading artifact: {zip_file}")
 
-    download_artifact(
-        url=download_url,
-        dest_file=zip_file,
-    )
+    download_artifact(url=download_url, dest_file=zip_file, size=size, digest=digest)
 
     with zipfile.ZipFile(zip_file, "r") as zip_ref:
         zip_ref.extractall(dest_dir)
     zip_file.unlink()
 
 
-def process_result_artifact(dest_dir: Path, download_url: str) -> None:
+def process_result_artifact(
+    dest_dir: Path, download_url: str, size: int = 0, digest: str = ""
+) -> None:
     """Process artifact."""
     dest_file = dest_dir / consts.REPORTS_ARCHIVE
     zip_file = dest_dir / f"{consts.RESULTS_ARTIFACT_NAME}.zip"
 
     if not (dest_dir / consts.REPORT_DOWNLOADED_SFILE).exists():
         dest_file.unlink(missing_ok=True)
-        _process_artifact(dest_dir=dest_dir, zip_file=zip_file, download_url=download_url)
+        _process_artifact(
+            dest_dir=dest_dir,
+            zip_file=zip_file,
+            download_url=download_url,
+            size=size,
+            digest=digest,
+        )
 
         # if the resulting artifact name doesn't match the expected one, rename it
         if not dest_file.exists():
@@ -87,14 +252,119 @@ def process_result_artifact(dest_dir: Path, download_url: str) -> None:
     (dest_dir / consts.REPORT_DOWNLOADED_SFILE).touch()
 
 
-def process_coverage_artifact(dest_dir: Path, download_url: str) -> None:
+class _TeeReader(io.RawIOBase):
+    """File-like object that copies all data it reads to another file."""
+
+    def __init__(self, src: IO[bytes], copy_fp: IO[bytes]) -> None:
+        super().__init__()
+        self.src = src
+        self.copy_fp = copy_fp
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        data = self.src.read(len(buffer))
+        self.copy_fp.write(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+    def drain(self) -> None:
+        """Copy the rest of the data that was not read by the consumer."""
+        while self.read(1024 * 1024):
+            pass
+
+
+def _spool_download(url: str, spool_fp: IO[bytes], size: int = 0, digest: str = "") -> None:
+    """Download data to a spooled file and verify its size and digest."""
+    algorithm, __, expected_hexdigest = digest.partition(":")
+    hash_obj = hashlib.new(algorithm or "sha256")
+
+    with get_session().get(
+        url, stream=True, allow_redirects=True, timeout=consts.HTTP_TIMEOUT
+    ) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(chunk_size=65536):
+            hash_obj.update(chunk)
+            spool_fp.write(chunk)
+
+    spool_size = spool_fp.tell()
+    if size and spool_size != size:
+        err = f"Size of data from '{url}' is {spool_size}, expected {size}."
+        raise ValueError(err)
+    if expected_hexdigest and hash_obj.hexdigest() != expected_hexdigest:
+        err = f"Digest of data from '{url}' is '{hash_obj.hexdigest()}', expected '{digest}'."
+        raise ValueError(err)
+
+    spool_fp.seek(0)
+
+
+def stream_result_artifact(
+    dest_dir: Path, download_url: str, size: int = 0, digest: str = ""
+) -> None:
+    """Process artifact without storing the intermediate zip file."""
+    if not download_url.startswith("https://"):
+        err = f"Invalid URL: {download_url}"
+        raise ValueError(err)
+
+    dest_file = dest_dir / consts.REPORTS_ARCHIVE
+    part_file = dest_dir / f"{consts.REPORTS_ARCHIVE}.part"
+    results_dir = dest_dir / consts.REPORTS_DIRNAME
+
+    if (dest_dir / consts.REPORT_DOWNLOADED_SFILE).exists():
+        return
+
+    dest_file.unlink(missing_ok=True)
+    shutil.rmtree(results_dir, ignore_errors=True)
+    LOGGER.info(f"Streaming artifact: {dest_file}")
+
+    # the zip format needs seeking, large downloads are spooled to disk
+    with tempfile.SpooledTemporaryFile(
+        max_size=consts.STREAM_SPOOL_MAX_SIZE, dir=str(dest_dir)
+    ) as spool_fp:
+        _spool_download(url=download_url, spool_fp=spool_fp, size=size, digest=digest)
+
+        with zipfile.ZipFile(spool_fp, "r") as zip_ref:
+            archives = [
+                m
+                for m in zip_ref.namelist()
+                if m.startswith(consts.RESULTS_ARTIFACT_NAME) and m.endswith(".tar.xz")
+            ]
+            if not archives:
+                zip_ref.extractall(dest_dir)
+            else:
+                # unpack in a single pass, keep a copy of the archive for the record
+                try:
+                    with zip_ref.open(archives[0]) as member_fp, open(part_file, "wb") as copy_fp:
+                        tee_fp = _TeeReader(src=member_fp, copy_fp=copy_fp)
+                        with tarfile.open(fileobj=tee_fp, mode="r|xz") as tar:
+                            tar.extractall(path=dest_dir)
+                        tee_fp.drain()
+                except Exception:
+                    shutil.rmtree(results_dir, ignore_errors=True)
+                    part_file.unlink(missing_ok=True)
+                    raise
+                part_file.replace(dest_file)
+
+    (dest_dir / consts.REPORT_DOWNLOADED_SFILE).touch()
+
+
+def process_coverage_artifact(
+    dest_dir: Path, download_url: str, size: int = 0, digest: str = ""
+) -> None:
     """Process artifact."""
     dest_file = dest_dir / f"{consts.COV_ARTIFACT_NAME}.json"
     zip_file = dest_dir / f"{consts.COV_ARTIFACT_NAME}.zip"
 
     if not (dest_dir / consts.COV_DOWNLOADED_SFILE).exists():
         dest_file.unlink(missing_ok=True)
-        _process_artifact(dest_dir=dest_dir, zip_file=zip_file, download_url=download_url)
+        _process_artifact(
+            dest_dir=dest_dir,
+            zip_file=zip_file,
+            download_url=download_url,
+            size=size,
+            digest=digest,
+        )
 
         # if the resulting artifact name doesn't match the expected one, rename it
         if not dest_file.exists():
@@ -103,3 +373,71 @@ def process_coverage_artifact(dest_dir: Path, download_url: str) -> None:
                 break
 
     (dest_dir / consts.COV_DOWNLOADED_SFILE).touch()
+
+
+def process_artifact_task(task: ArtifactTask, stream: bool = False) -> None:
+    """Process artifact described by the `ArtifactTask` record."""
+    task.dest_dir.mkdir(parents=True, exist_ok=True)
+    if task.is_coverage:
+        process_func = process_coverage_artifact
+    elif stream:
+        process_func = stream_result_artifact
+    else:
+        process_func = process_result_artifact
+    process_func(
+        dest_dir=task.dest_dir, download_url=task.download_url, size=task.size, digest=task.digest
+    )
+
+
+def is_task_done(task: ArtifactTask) -> bool:
+    """Check if the artifact was already downloaded."""
+    sfile = consts.COV_DOWNLOADED_SFILE if task.is_coverage else consts.REPORT_DOWNLOADED_SFILE
+    return (task.dest_dir / sfile).exists()
+
+
+def record_task(
+    index: "state_index.StateIndex", task: ArtifactTask, only_new: bool = False
+) -> None:
+    """Record the processed artifact in the state index."""
+    if task.is_coverage:
+        index.record_coverage(dest_dir=task.dest_dir, only_new=only_new)
+    else:
+        index.record_results(dest_dir=task.dest_dir, only_new=only_new)
+
+
+def _process_and_record(
+    task: ArtifactTask, stream: bool, index: Optional["state_index.StateIndex"]
+) -> None:
+    process_artifact_task(task=task, stream=stream)
+    # record in the worker, so an artifact that is marked as downloaded is also in the index
+    # even if the main thread doesn't get to it
+    if index:
+        record_task(index=index, task=task)
+
+
+def download_artifacts(
+    tasks: Iterable[ArtifactTask],
+    jobs: int = consts.DOWNLOAD_JOBS,
+    stream: bool = False,
+    index: Optional["state_index.StateIndex"] = None,
+) -> int:
+    """Download and unpack artifacts on a bounded pool of workers, return number of failures."""
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {}
+        for t in tasks:
+            if not is_task_done(t):
+                futures[executor.submit(_process_and_record, t, stream, index)] = t
+            elif index:
+                # the process could have been killed between writing the marker and the record
+                record_task(index=index, task=t, only_new=True)
+
+        for future in concurrent.futures.as_completed(futures):
+            exc = future.exception()
+            if exc is None:
+                continue
+            # the artifact is not marked as downloaded, so it is retried on the next run
+            failed += 1
+            LOGGER.error(f"Failed to process artifact: {futures[future]}", exc_info=exc)
+
+    return failed
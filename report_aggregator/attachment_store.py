@@ -0,0 +1,106 @@
+"""Content-addressed store of report attachments shared by all published reports."""
+
+import contextlib
+import errno
+import logging
+import os
+from pathlib import Path
+from typing import Tuple
+
+from report_aggregator import consts
+from report_aggregator import fileops
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_store_dir(web_base_dir: Path) -> Path:
+    """Return the attachment store dir under the web root."""
+    return web_base_dir / consts.ATTACHMENTS_STORE_DIRNAME
+
+
+def _link_from_store(stored_file: Path, file: Path) -> None:
+    """Atomically replace the file with a hardlink to the stored file."""
+    tmp_file = file.with_name(f".{file.name}.tmp")
+    tmp_file.unlink(missing_ok=True)
+    os.link(stored_file, tmp_file)
+    tmp_file.replace(file)
+
+
+def store_file(file: Path, store_dir: Path) -> bool:
+    """Move the file to the store, leave a hardlink to the stored copy in its place.
+
+    Return True if the same content was already in the store and the file was deduplicated.
+    """
+    digest = fileops.get_file_digest(path=file)
+    stored_file = store_dir / digest[:2] / digest
+    stored_file.parent.mkdir(parents=True, exist_ok=True)
+
+    for __ in range(2):
+        try:
+            os.link(file, stored_file)
+        except FileExistsError:
+            pass
+        else:
+            return False
+
+        try:
+            _link_from_store(stored_file=stored_file, file=file)
+        except FileNotFoundError:
+            # the stored file was garbage collected in the meantime, store the file again
+            continue
+        return True
+
+    return False
+
+
+def store_attachments(attachments_dir: Path, store_dir: Path) -> Tuple[int, int]:
+    """Move attachments of a report to the store.
+
+    Return number of deduplicated files and number of bytes saved.
+    """
+    if not attachments_dir.is_dir():
+        return 0, 0
+
+    dedup_count = dedup_size = 0
+    for file in attachments_dir.iterdir():
+        if not file.is_file() or file.is_symlink():
+            continue
+
+        size = file.stat().st_size
+        if not size:
+            continue
+
+        try:
+            deduplicated = store_file(file=file, store_dir=store_dir)
+        except OSError as exc:
+            # e.g. too many links to the same file, keep the file as is
+            if exc.errno not in (errno.EMLINK, errno.EXDEV, errno.EPERM):
+                raise
+            continue
+
+        if deduplicated:
+            dedup_count += 1
+            dedup_size += size
+
+    LOGGER.debug(f"Deduplicated {dedup_count} attachments ({dedup_size} bytes): {attachments_dir}")
+    return dedup_count, dedup_size
+
+
+def collect_garbage(store_dir: Path) -> int:
+    """Remove stored files that are no longer referenced by any report.
+
+    Reports reference the stored files by hardlinks, so a file with a single link is
+    referenced only by the store itself. Return number of removed files.
+    """
+    if not store_dir.is_dir():
+        return 0
+
+    removed = 0
+    for stored_file in store_dir.glob("*/*"):
+        with contextlib.suppress(FileNotFoundError):
+            if stored_file.stat().st_nlink == 1:
+                stored_file.unlink()
+                removed += 1
+
+    LOGGER.info(f"Removed {removed} unreferenced attachments from the store: {store_dir}")
+    return removed
@@ -1,14 +1,22 @@
 import logging
 import tempfile
 from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
 
 import click
 
 from report_aggregator import consts
 from report_aggregator import coverage_publisher
+from report_aggregator import daemon
 from report_aggregator import nightly_github
+from report_aggregator import precompress
 from report_aggregator import publisher
 from report_aggregator import regression_github
+from report_aggregator import state_index
 
 DEFAULT_LOG_LEVEL = "WARNING"
 
@@ -43,10 +51,25 @@ def cli(log_level: str = DEFAULT_LOG_LEVEL) -> None:
     show_default=True,
     help="Look for runs started from TIMEDELTA_MINS in the past until now (in minutes).",
 )
-def nightly_github_cli(results_dir: str, timedelta_mins: int) -> None:
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=consts.DOWNLOAD_JOBS,
+    show_default=True,
+    help="Number of artifacts to download in parallel.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Unpack results while downloading, without storing the intermediate zip file.",
+)
+def nightly_github_cli(results_dir: str, timedelta_mins: int, jobs: int, stream: bool) -> None:
     """Download nightly results from Github."""
     nightly_github.download_nightly_results(
-        base_dir=Path(results_dir), timedelta_mins=timedelta_mins
+        base_dir=Path(results_dir), timedelta_mins=timedelta_mins, jobs=jobs, stream=stream
     )
 
 
@@ -79,8 +102,28 @@ def nightly_github_cli(results_dir: str, timedelta_mins: int) -> None:
     show_default=True,
     help="Look for runs started from TIMEDELTA_MINS in the past until now (in minutes).",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=consts.DOWNLOAD_JOBS,
+    show_default=True,
+    help="Number of artifacts to download in parallel.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Unpack results while downloading, without storing the intermediate zip file.",
+)
 def regression_github_cli(
-    results_dir: str, testrun_name: str, repo_slug: str, timedelta_mins: int
+    results_dir: str,
+    testrun_name: str,
+    repo_slug: str,
+    timedelta_mins: int,
+    jobs: int,
+    stream: bool,
 ) -> None:
     """Download regression results for testrun from Github."""
     regression_github.download_testrun_results(
@@ -88,9 +131,116 @@ def regression_github_cli(
         testrun_name=testrun_name,
         repo_slug=repo_slug,
         timedelta_mins=timedelta_mins,
+        jobs=jobs,
+        stream=stream,
     )
 
 
+def get_compress_formats(no_precompress: bool, brotli: bool) -> Tuple[str, ...]:
+    """Return formats of compressed siblings of static files."""
+    if no_precompress:
+        return ()
+    return (*consts.PRECOMPRESS_FORMATS, "br") if brotli else consts.PRECOMPRESS_FORMATS
+
+
+PUBLISH_OPTIONS = [
+    click.option(
+        "--unpack-jobs",
+        type=int,
+        default=consts.STAGING_JOBS,
+        show_default=True,
+        help="Number of result sets to unpack in parallel.",
+    ),
+    click.option(
+        "--allure-jobs",
+        type=int,
+        default=consts.ALLURE_JOBS,
+        show_default=True,
+        help="Number of Allure reports to generate in parallel.",
+    ),
+    click.option(
+        "--allure-heap",
+        default=consts.ALLURE_HEAP,
+        help="Max Java heap size of each Allure process, e.g. '1g' (default: JVM default).",
+    ),
+    click.option(
+        "--web-jobs",
+        type=int,
+        default=consts.WEB_JOBS,
+        show_default=True,
+        help="Number of generated reports compressed and published in parallel.",
+    ),
+    click.option(
+        "--queue-size",
+        type=int,
+        default=consts.REPORTS_QUEUE_SIZE,
+        show_default=True,
+        help="Number of unpacked results that can wait for Allure.",
+    ),
+    click.option(
+        "--jvm-cache-dir",
+        default=consts.JVM_CACHE_DIR,
+        show_default=True,
+        help=(
+            "Directory for the class data sharing archive that speeds up startup of Allure. "
+            "Set to empty string to disable."
+        ),
+    ),
+    click.option(
+        "--history-keep",
+        type=int,
+        default=consts.HISTORY_KEEP,
+        show_default=True,
+        help="Number of builds kept in the history of each report.",
+    ),
+    click.option(
+        "--no-precompress",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help="Don't write compressed '.gz' siblings of static files of the reports.",
+    ),
+    click.option(
+        "--brotli",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help="Write also compressed '.br' siblings of static files of the reports.",
+    ),
+]
+
+
+def publish_options(func: Callable) -> Callable:
+    """Add options of report publishing shared by the `publish` and `serve` commands."""
+    for option in reversed(PUBLISH_OPTIONS):
+        func = option(func)
+    return func
+
+
+def get_publish_options(
+    unpack_jobs: int,
+    allure_jobs: int,
+    allure_heap: str,
+    web_jobs: int,
+    queue_size: int,
+    jvm_cache_dir: str,
+    history_keep: int,
+    no_precompress: bool,
+    brotli: bool,
+) -> Dict[str, Any]:
+    """Return arguments of `publisher.publish` that correspond to the publishing options."""
+    return {
+        "staging_jobs": unpack_jobs,
+        "allure_jobs": allure_jobs,
+        "java_heap": allure_heap,
+        "web_jobs": web_jobs,
+        "queue_size": queue_size,
+        "jvm_cache_dir": Path(jvm_cache_dir) if jvm_cache_dir else None,
+        "history_keep": history_keep,
+        "compress_formats": get_compress_formats(no_precompress=no_precompress, brotli=brotli),
+    }
+
+
 @cli.command()
 @click.option(
     "-d",
@@ -113,21 +263,191 @@ def regression_github_cli(
     default=False,
     help="Aggregate new results from the same testrun (job).",
 )
-def publish(results_dir: str, web_dir: str, aggregate: bool) -> None:
+@click.option(
+    "--rescan",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Rebuild the index of results from the results dir (e.g. after adding results manually).",
+)
+@click.option(
+    "--tmp-dir",
+    "tmp_base_dir",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help=(
+        "Base directory for temporary files. When on the same filesystem as the results "
+        "dir, files are linked instead of copied."
+    ),
+)
+@publish_options
+def publish(
+    results_dir: str,
+    web_dir: str,
+    aggregate: bool,
+    rescan: bool,
+    tmp_base_dir: Optional[str],
+    **options: Any,
+) -> None:
     """Publish reports."""
-    with tempfile.TemporaryDirectory() as tmp_dir:
+    if rescan:
+        state_index.StateIndex(base_dir=Path(results_dir)).rescan()
+
+    with tempfile.TemporaryDirectory(dir=tmp_base_dir) as tmp_dir:
         results_tmp_dir = Path(tmp_dir) / "results"
-        reports_tmp_dir = Path(tmp_dir) / "reports"
 
         publisher.publish(
             new_results_base_dir=Path(results_dir),
             web_base_dir=Path(web_dir),
             results_tmp_dir=results_tmp_dir,
-            reports_tmp_dir=reports_tmp_dir,
             aggregate_results=aggregate,
+            **get_publish_options(**options),
         )
 
 
+@cli.command("precompress")
+@click.option(
+    "-w",
+    "--web-dir",
+    required=True,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Base directory with published reports.",
+)
+@click.option(
+    "--brotli",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Write also compressed '.br' siblings.",
+)
+@click.option(
+    "--min-size",
+    type=int,
+    default=consts.PRECOMPRESS_MIN_SIZE,
+    show_default=True,
+    help="Don't compress files smaller than this (in bytes).",
+)
+def precompress_cmd(web_dir: str, brotli: bool, min_size: int) -> None:
+    """Write compressed siblings of static files of already published reports."""
+    precompress.compress_dir(
+        base_dir=Path(web_dir),
+        formats=get_compress_formats(no_precompress=False, brotli=brotli),
+        min_size=min_size,
+        exclude=(consts.ATTACHMENTS_STORE_DIRNAME, consts.HISTORY_STORE_DIRNAME),
+    )
+
+
+@cli.command("serve")
+@click.option(
+    "-d",
+    "--results-dir",
+    required=True,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Base directory for results.",
+)
+@click.option(
+    "-w",
+    "--web-dir",
+    required=True,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Base directory for published reports.",
+)
+@click.option(
+    "-c",
+    "--coverage-web-dir",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Base directory for published coverage. Coverage is not published if not set.",
+)
+@click.option(
+    "--no-daily-dump",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Don't keep full coverage report of each day, keep just the latest one.",
+)
+@click.option(
+    "-m",
+    "--timedelta-mins",
+    type=int,
+    default=consts.TIMEDELTA_MINS,
+    show_default=True,
+    help="Look for runs started from TIMEDELTA_MINS in the past until now (in minutes).",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=consts.DOWNLOAD_JOBS,
+    show_default=True,
+    help="Number of artifacts to download in parallel.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Unpack results while downloading, without storing the intermediate zip file.",
+)
+@click.option(
+    "--tmp-dir",
+    "tmp_base_dir",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    help="Base directory for temporary files.",
+)
+@publish_options
+@click.option(
+    "--min-interval",
+    type=int,
+    default=consts.SERVE_MIN_INTERVAL,
+    show_default=True,
+    help="Minimal interval between polls (in seconds).",
+)
+@click.option(
+    "--max-interval",
+    type=int,
+    default=consts.SERVE_MAX_INTERVAL,
+    show_default=True,
+    help="Maximal interval between polls (in seconds).",
+)
+@click.option(
+    "--port",
+    type=int,
+    default=consts.SERVE_PORT,
+    show_default=True,
+    help="Port of the status endpoint on localhost.",
+)
+def serve(
+    results_dir: str,
+    web_dir: str,
+    coverage_web_dir: Optional[str],
+    no_daily_dump: bool,
+    timedelta_mins: int,
+    jobs: int,
+    stream: bool,
+    tmp_base_dir: Optional[str],
+    min_interval: int,
+    max_interval: int,
+    port: int,
+    **options: Any,
+) -> None:
+    """Keep downloading and publishing new nightly results and coverage."""
+    daemon.serve(
+        daemon=daemon.Daemon(
+            base_dir=Path(results_dir),
+            web_dir=Path(web_dir),
+            coverage_web_dir=Path(coverage_web_dir) if coverage_web_dir else None,
+            coverage_daily_dump=not no_daily_dump,
+            timedelta_mins=timedelta_mins,
+            jobs=jobs,
+            stream=stream,
+            tmp_base_dir=Path(tmp_base_dir) if tmp_base_dir else None,
+            min_interval=min_interval,
+            max_interval=max_interval,
+            publish_options=get_publish_options(**options),
+        ),
+        port=port,
+    )
+
+
 @cli.command("publish-coverage")
 @click.option(
     "-d",
@@ -143,9 +463,27 @@ def publish(results_dir: str, web_dir: str, aggregate: bool) -> None:
     type=click.Path(exists=True, file_okay=False, dir_okay=True),
     help="Base directory for published coverage.",
 )
-def publish_coverage(results_dir: str, web_dir: str) -> None:
+@click.option(
+    "--rescan",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Rebuild the index of results from the results dir (e.g. after adding results manually).",
+)
+@click.option(
+    "--no-daily-dump",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Don't keep full coverage report of each day, keep just the latest one.",
+)
+def publish_coverage(results_dir: str, web_dir: str, rescan: bool, no_daily_dump: bool) -> None:
     """Publish reports."""
+    if rescan:
+        state_index.StateIndex(base_dir=Path(results_dir)).rescan()
+
     coverage_publisher.publish(
         results_base_dir=Path(results_dir),
         web_dir=Path(web_dir),
+        daily_dump=not no_daily_dump,
     )
@@ -1,20 +1,76 @@
 import os
+from pathlib import Path
 
 REPORT_DOWNLOADED_SFILE = ".downloaded"
 REPORT_PUBLISHED_SFILE = ".published"
 
 COV_DOWNLOADED_SFILE = ".downloaded_cov"
+# cache of parsed coverage files, in the results base dir
+COV_CACHE_DIRNAME = ".coverage_cache"
+# number of days in the published coverage trend
+COV_TREND_DAYS = 90
 
 STEPS_BASE = "step"
 REPORTS_DIRNAME = "allure-results"
 REPORTS_ARCHIVE = "allure-results.tar.xz"
+# number of versions of each published report to keep, including the live one
+REPORT_VERSIONS_KEEP = 2
+# hashes of inputs the published report was generated from
+REPORT_INPUTS_FILE = ".report_inputs.json"
+# content-addressed store of attachments shared by all reports, under the web root
+ATTACHMENTS_STORE_DIRNAME = ".attachments"
+# store of report history under the web root, and number of builds kept in the history
+HISTORY_STORE_DIRNAME = ".history"
+HISTORY_KEEP = 30
+# compressed siblings written for static files of reports, so web server doesn't need
+# to compress them on each request
+PRECOMPRESS_FORMATS = ("gz",)
+PRECOMPRESS_MIN_SIZE = 1024
+PRECOMPRESS_JOBS = os.cpu_count() or 1
+# number of Allure reports generated in parallel and max Java heap size of each Allure process
+# (JVM default when empty)
+ALLURE_JOBS = 2
+ALLURE_HEAP = ""
+# number of generated reports compressed and published in parallel, and number of staged
+# results that can wait for Allure
+WEB_JOBS = 2
+REPORTS_QUEUE_SIZE = 4
+# cache for the class data sharing archive that speeds up startup of the Allure JVM
+JVM_CACHE_DIR = str(
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "report-aggregator"
+)
 TIMEDELTA_MINS = 48 * 60
+DOWNLOAD_JOBS = 4
+# number of concurrent Github API requests when searching for runs and their artifacts
+DISCOVERY_JOBS = 8
+STAGING_JOBS = os.cpu_count() or 1
+
+# polling interval bounds of the `serve` command (in seconds), and port of its status endpoint
+SERVE_MIN_INTERVAL = 60
+SERVE_MAX_INTERVAL = 30 * 60
+SERVE_PORT = 8750
+
+HTTP_POOL_SIZE = 16
+HTTP_RETRIES = 5
+HTTP_BACKOFF_FACTOR = 2.0
+HTTP_TIMEOUT = 300
+
+# minimal interval between Github API requests (in seconds)
+API_MIN_INTERVAL = 0.1
+# when fewer API requests than this remain, spread them evenly until the rate limit reset
+API_RESERVE = 500
+# initial backoff after hitting secondary rate limit (in seconds)
+API_SECONDARY_BACKOFF = 60
+# max size of downloaded artifact kept in memory when streaming (per download job), bigger ones
+# are spooled to disk
+STREAM_SPOOL_MAX_SIZE = 8 * 1024 * 1024
 
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN") or ""
 AUTH_HEADERS = {
     "Accept": "application/vnd.github+json",
     "Authorization": f"Bearer {GITHUB_TOKEN}",
 }
+API_URL = "https://api.github.com"
 ORG_NAME = "IntersectMBO"
 REPO_SLUG = f"{ORG_NAME}/cardano-node-tests"
 RESULTS_ARTIFACT_NAME = "allure-results"
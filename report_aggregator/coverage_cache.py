@@ -0,0 +1,89 @@
+"""Persistent cache of parsed coverage files."""
+
+import contextlib
+import hashlib
+import logging
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from report_aggregator import consts
+from report_aggregator import coverage_tree
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+
+def get_file_key(cov_file: Path) -> Tuple[str, int, int]:
+    """Return key identifying the current content of the file."""
+    file_stat = cov_file.stat()
+    return str(cov_file.resolve()), file_stat.st_mtime_ns, file_stat.st_size
+
+
+class CoverageCache:
+    """Cache of coverage trees parsed from coverage files.
+
+    Each coverage file has its own cache entry, valid as long as the path, mtime and size
+    of the file are unchanged. Entries of files that are no longer used are removed
+    by `evict`.
+    """
+
+    def __init__(self, base_dir: Path) -> None:
+        self.cache_dir = base_dir / consts.COV_CACHE_DIRNAME
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _get_entry_file(self, cov_file: Path) -> Path:
+        path_hash = hashlib.sha256(str(cov_file.resolve()).encode()).hexdigest()
+        return self.cache_dir / f"{path_hash}.pickle"
+
+    def get(self, cov_file: Path) -> Optional[coverage_tree.CoverageNode]:
+        """Return cached coverage tree of the file, if it is current."""
+        entry_file = self._get_entry_file(cov_file=cov_file)
+        try:
+            with open(entry_file, "rb") as in_fp:
+                version, key, coverage = pickle.load(in_fp)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            LOGGER.warning(f"Ignoring invalid coverage cache entry '{entry_file}'")
+            return None
+
+        if (
+            version != CACHE_VERSION
+            or key != get_file_key(cov_file=cov_file)
+            or not isinstance(coverage, coverage_tree.CoverageNode)
+        ):
+            return None
+        return coverage
+
+    def set(self, cov_file: Path, coverage: coverage_tree.CoverageNode) -> None:
+        """Store coverage tree of the file."""
+        entry_file = self._get_entry_file(cov_file=cov_file)
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_dir, prefix=f".{entry_file.name}.", delete=False
+        ) as out_fp:
+            pickle.dump(
+                (CACHE_VERSION, get_file_key(cov_file=cov_file), coverage),
+                out_fp,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        Path(out_fp.name).replace(entry_file)
+
+    def evict(self, keep: Iterable[Path]) -> int:
+        """Remove entries of all files except those in `keep`, return number of removed entries."""
+        keep_names = {self._get_entry_file(cov_file=f).name for f in keep}
+        removed = 0
+        for entry_file in self.cache_dir.iterdir():
+            if entry_file.name in keep_names:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                entry_file.unlink()
+                removed += 1
+
+        if removed:
+            LOGGER.debug(f"Removed {removed} coverage cache entries")
+        return removed
@@ -0,0 +1,113 @@
+"""Time series of CLI coverage, and coverage trends precomputed from it."""
+
+import contextlib
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Generator
+from typing import List
+from typing import Tuple
+
+from report_aggregator import consts
+from report_aggregator import fileops
+
+LOGGER = logging.getLogger(__name__)
+
+DB_FILE_NAME = ".coverage_history.sqlite"
+TREND_FILE_NAME = "coverage_trend.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS coverage (
+    date TEXT NOT NULL,
+    command TEXT NOT NULL,
+    coverage REAL NOT NULL,
+    PRIMARY KEY (date, command)
+);
+"""
+
+
+def iter_command_coverage(
+    report: Dict[str, Any], arg_name: str, parents: Tuple[str, ...] = ()
+) -> Generator[Tuple[str, float], None, None]:
+    """Yield command (e.g. 'cardano-cli latest transaction build') and its coverage."""
+    path = (*parents, arg_name)
+    coverage = report.get(f"_coverage_{arg_name}")
+    if coverage is not None:
+        yield " ".join(path), coverage
+
+    for key, value in report.items():
+        if isinstance(value, dict):
+            yield from iter_command_coverage(report=value, arg_name=key, parents=path)
+
+
+class CoverageHistory:
+    """Coverage of each command, one record per day."""
+
+    def __init__(self, base_dir: Path) -> None:
+        self.db_file = base_dir / DB_FILE_NAME
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        with contextlib.closing(sqlite3.connect(str(self.db_file), timeout=60)) as conn, conn:
+            yield conn
+
+    def record(self, date: str, report: Dict[str, Any]) -> None:
+        """Record coverage report of the given day (e.g. '2024-01-31').
+
+        The previous record of the day is replaced.
+        """
+        rows = [
+            (date, command, coverage)
+            for command, coverage in iter_command_coverage(
+                report=report.get("cardano-cli") or {}, arg_name="cardano-cli"
+            )
+        ]
+        with self._connect() as conn:
+            conn.execute("DELETE FROM coverage WHERE date = ?", (date,))
+            conn.executemany(
+                "INSERT INTO coverage (date, command, coverage) VALUES (?, ?, ?)", rows
+            )
+
+    def get_trend(self, days: int = consts.COV_TREND_DAYS) -> Dict[str, Any]:
+        """Return coverage of each command for the last `days` days with records.
+
+        Days when a command didn't exist yet have `null` coverage.
+        """
+        with self._connect() as conn:
+            dates: List[str] = [
+                r[0]
+                for r in conn.execute(
+                    "SELECT DISTINCT date FROM coverage ORDER BY date DESC LIMIT ?", (days,)
+                )
+            ]
+            dates.reverse()
+            rows = conn.execute(
+                "SELECT date, command, coverage FROM coverage WHERE date >= ? "
+                "ORDER BY command, date",
+                (dates[0] if dates else "",),
+            ).fetchall()
+
+        date_idx = {d: i for i, d in enumerate(dates)}
+        commands: Dict[str, List[Any]] = {}
+        for date, command, coverage in rows:
+            values = commands.setdefault(command, [None] * len(dates))
+            values[date_idx[date]] = round(coverage, 2)
+
+        return {"dates": dates, "commands": commands}
+
+
+def publish_trend(base_dir: Path, web_dir: Path, report: Dict[str, Any]) -> Path:
+    """Record today's coverage report and write the coverage trend to the web dir."""
+    history = CoverageHistory(base_dir=base_dir)
+    history.record(date=time.strftime("%Y-%m-%d"), report=report)
+
+    trend_file = web_dir / TREND_FILE_NAME
+    fileops.write_text(path=trend_file, text=json.dumps(history.get_trend()))
+    LOGGER.info(f"Coverage trend published to '{trend_file}'")
+    return trend_file
@@ -2,13 +2,21 @@ import json
 import logging
 import time
 from pathlib import Path
-from typing import Any
-from typing import Dict
 from typing import Generator
 from typing import Iterable
+from typing import Optional
 from typing import Tuple
 
-from report_aggregator import consts
+from report_aggregator import coverage_cache
+from report_aggregator import coverage_history
+from report_aggregator import coverage_tree
+from report_aggregator import fileops
+from report_aggregator import state_index
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 LOGGER = logging.getLogger(__name__)
 
@@ -23,66 +31,70 @@ SKIPPED = (
 
 
 def get_latest_coverage(base_dir: Path) -> Generator[Path, None, None]:
-    """Walk new results directories and yield latest coverage."""
+    """Yield latest coverage for each nightly workflow."""
     ago_14_days = time.time() - 14 * 24 * 3600
-    for nd in base_dir.rglob("*tests-nightly*"):
-        for p in sorted(nd.rglob(consts.COV_DOWNLOADED_SFILE), reverse=True):
-            cov_file = p.parent / consts.COV_FILE_NAME
-            # Don't consider the file if it is older than 14 days
-            if cov_file.is_file() and cov_file.stat().st_mtime > ago_14_days:
-                LOGGER.debug(f"Using coverage file {cov_file}")
-                yield cov_file
-                # only last coverage file per nightly workflow`
-                break
-
-
-def merge_coverage(dict_a: dict, dict_b: dict) -> dict:
-    """Merge dict_b into dict_a."""
-    if not (isinstance(dict_a, dict) and isinstance(dict_b, dict)):
-        return dict_a
-
-    mergeable = (list, set, tuple)
-    addable = (int, float)
-    for key, value in dict_b.items():
-        # pyrefly: ignore  # invalid-argument
-        if key in dict_a and isinstance(value, mergeable) and isinstance(dict_a[key], mergeable):
-            new_list = set(dict_a[key]).union(value)
-            dict_a[key] = sorted(new_list)
-        # pyrefly: ignore  # invalid-argument
-        elif key in dict_a and isinstance(value, addable) and isinstance(dict_a[key], addable):
-            dict_a[key] += value
-        elif (key not in dict_a) or not isinstance(value, dict):
-            dict_a[key] = value
-        else:
-            merge_coverage(dict_a[key], value)
-
-    return dict_a
-
-
-def get_merged_coverage(coverage_files: Iterable[Path]) -> Dict[str, Any]:
-    """Get coverage info by merging available data."""
-    coverage_dict: Dict[str, Any] = {}
-    for in_coverage in coverage_files:
+    index = state_index.StateIndex(base_dir=base_dir)
+    # Don't consider the files older than 14 days
+    for cov_file in index.get_latest_coverage(
+        job_pattern="*tests-nightly*", newer_than=ago_14_days
+    ):
+        if cov_file.is_file():
+            LOGGER.debug(f"Using coverage file {cov_file}")
+            yield cov_file
+
+
+def load_coverage(in_coverage: Path) -> coverage_tree.CoverageNode:
+    """Load coverage tree from a coverage file.
+
+    The file is parsed incrementally when `ijson` is available, so it's never loaded whole
+    into memory.
+    """
+    if ijson is None:
         with open(in_coverage, encoding="utf-8") as infile:
-            coverage = json.load(infile)
-
-        if coverage.get("cardano-cli", {}).get("latest") is None:
-            err = f"Data in '{in_coverage}' doesn't seem to be in proper coverage format."
-            raise AttributeError(err)
+            coverage = coverage_tree.CoverageNode().update_from_dict(json.load(infile))
+    else:
+        with open(in_coverage, "rb") as infile:
+            coverage = coverage_tree.build_from_events(ijson.parse(infile, use_float=True))
+
+    cli_coverage = coverage.entries.get("cardano-cli")
+    if (
+        not isinstance(cli_coverage, coverage_tree.CoverageNode)
+        or cli_coverage.entries.get("latest") is None
+    ):
+        err = f"Data in '{in_coverage}' doesn't seem to be in proper coverage format."
+        raise AttributeError(err)
+
+    return coverage
+
+
+def get_merged_coverage(
+    coverage_files: Iterable[Path], cache: Optional[coverage_cache.CoverageCache] = None
+) -> coverage_tree.CoverageNode:
+    """Get coverage info by merging available data.
+
+    Only files that are not in the `cache` yet are parsed.
+    """
+    coverage_root = coverage_tree.CoverageNode()
+    for in_coverage in coverage_files:
+        coverage = cache.get(cov_file=in_coverage) if cache else None
+        if coverage is None:
+            coverage = load_coverage(in_coverage=in_coverage)
+            if cache:
+                cache.set(cov_file=in_coverage, coverage=coverage)
 
-        coverage_dict = merge_coverage(coverage_dict, coverage)
+        coverage_root.merge(coverage)
 
-    return coverage_dict
+    return coverage_root
 
 
 def get_report(
-    arg_name: str, coverage: dict, uncovered_only: bool = False
+    arg_name: str, coverage: coverage_tree.CoverageNode, uncovered_only: bool = False
 ) -> Tuple[dict, int, int]:
     """Generate coverage report."""
     uncovered_db: dict = {}
     covered_count = 0
     uncovered_count = 0
-    for key, value in coverage.items():
+    for key, value in coverage.entries.items():
         if key.startswith("_coverage") or key in SKIPPED:
             continue
 
@@ -94,7 +106,7 @@ def get_report(
             uncovered_db[key] = value
             continue
 
-        if isinstance(value, dict):
+        if isinstance(value, coverage_tree.CoverageNode):
             ret_db, ret_covered_count, ret_uncovered_count = get_report(
                 arg_name=key, coverage=value, uncovered_only=uncovered_only
             )
@@ -114,7 +126,7 @@ def get_report(
             uncovered_db[key] = count
 
     # in case all options were skipped, the command is covered if it was executed at least once
-    if covered_count == 0 and coverage[f"_count_{arg_name}"] > 0:
+    if covered_count == 0 and coverage.entries[f"_count_{arg_name}"] > 0:
         covered_count = 1
 
     uncovered_db[f"_coverage_{arg_name}"] = (
@@ -127,9 +139,18 @@ def get_report(
 def publish(
     results_base_dir: Path,
     web_dir: Path,
+    daily_dump: bool = True,
 ) -> None:
-    """Publish coverage report."""
-    coverage = get_merged_coverage(coverage_files=get_latest_coverage(base_dir=results_base_dir))
+    """Publish coverage report.
+
+    The full report is written to a new file each day when `daily_dump` is enabled,
+    otherwise just the latest report is kept.
+    """
+    coverage_files = list(get_latest_coverage(base_dir=results_base_dir))
+    cache = coverage_cache.CoverageCache(base_dir=results_base_dir)
+    coverage = get_merged_coverage(coverage_files=coverage_files, cache=cache)
+    # files out of the window are not needed anymore
+    cache.evict(keep=coverage_files)
     report, *__ = get_report(arg_name="cardano-cli", coverage=coverage)
 
     # round the top-level coverage
@@ -140,18 +161,26 @@ def publish(
         report["_coverage_cardano-cli"] = rounded_coverage
 
     web_dir.mkdir(parents=True, exist_ok=True)
-    todays_coverage = web_dir / f"coverage_{time.strftime('%Y%m%d')}.json"
-
-    with open(todays_coverage, "w", encoding="utf-8") as outfile:
-        json.dump(report, outfile, indent=4)
-
-    LOGGER.info("Coverage report published to '%s'", todays_coverage)
+    coverage_history.publish_trend(base_dir=results_base_dir, web_dir=web_dir, report=report)
 
-    # symlink latest coverage
     latest_coverage = web_dir / "coverage.json"
-    if latest_coverage.is_symlink():
-        latest_coverage.unlink()
-    latest_coverage.symlink_to(todays_coverage.name)
+    # sets of values are sorted only when written out
+    report_json = json.dumps(report, indent=4, default=sorted)
+
+    if daily_dump:
+        todays_coverage = web_dir / f"coverage_{time.strftime('%Y%m%d')}.json"
+        todays_coverage.write_text(report_json, encoding="utf-8")
+        LOGGER.info("Coverage report published to '%s'", todays_coverage)
+
+        # symlink latest coverage
+        if latest_coverage.is_symlink():
+            latest_coverage.unlink()
+        latest_coverage.symlink_to(todays_coverage.name)
+    else:
+        if latest_coverage.is_symlink():
+            latest_coverage.unlink()
+        fileops.write_text(path=latest_coverage, text=report_json)
+        LOGGER.info("Coverage report published to '%s'", latest_coverage)
 
     # publish total coverage percentage
     if rounded_coverage:
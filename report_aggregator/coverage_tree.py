@@ -0,0 +1,122 @@
+"""Compact tree for merging CLI coverage data."""
+
+import sys
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+MERGEABLE = (list, set, tuple)
+ADDABLE = (int, float)
+
+
+class CoverageNode:
+    """Node of the coverage tree, e.g. a CLI command.
+
+    Entries are either child nodes (subcommands), numbers (usage counters) or sets
+    (e.g. values used for an option). Counters are summed and sets are united when merging
+    coverage data, the sets are sorted only when the tree is converted back to dict.
+    Keys are interned, as the same command and option names repeat in every coverage file.
+    """
+
+    __slots__ = ("entries",)
+
+    def __init__(self) -> None:
+        self.entries: Dict[str, Any] = {}
+
+    def get_child(self, key: str) -> "CoverageNode":
+        """Return child node, create it if needed."""
+        child = self.entries.get(key)
+        if isinstance(child, CoverageNode):
+            return child
+        if key in self.entries:
+            # existing value is kept, the merged data are discarded
+            return CoverageNode()
+
+        child = self.entries[sys.intern(key)] = CoverageNode()
+        return child
+
+    def add_value(self, key: str, value: Any) -> None:
+        """Merge a leaf value."""
+        cur_value = self.entries.get(key)
+        if isinstance(value, MERGEABLE):
+            if isinstance(cur_value, set):
+                cur_value.update(value)
+            else:
+                self.entries[sys.intern(key)] = set(value)
+        elif isinstance(value, ADDABLE) and isinstance(cur_value, ADDABLE):
+            self.entries[key] = cur_value + value
+        else:
+            self.entries[sys.intern(key)] = value
+
+    def update_from_dict(self, data: Dict[str, Any]) -> "CoverageNode":
+        """Merge coverage data loaded from JSON."""
+        for key, value in data.items():
+            if isinstance(value, dict):
+                self.get_child(key).update_from_dict(value)
+            else:
+                self.add_value(key, value)
+        return self
+
+    def merge(self, other: "CoverageNode") -> "CoverageNode":
+        """Merge other coverage tree into this one."""
+        for key, value in other.entries.items():
+            if isinstance(value, CoverageNode):
+                self.get_child(key).merge(value)
+            else:
+                self.add_value(key, value)
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the tree to dict that can be serialized to JSON."""
+        data: Dict[str, Any] = {}
+        for key, value in self.entries.items():
+            if isinstance(value, CoverageNode):
+                data[key] = value.to_dict()
+            elif isinstance(value, set):
+                data[key] = sorted(value)
+            else:
+                data[key] = value
+        return data
+
+
+def build_from_events(events: Iterable[Tuple[str, str, Any]]) -> CoverageNode:
+    """Build coverage tree from JSON parser events (e.g. produced by `ijson.parse`).
+
+    Objects are folded into the tree as they are parsed, only arrays of values are kept
+    in memory until they are complete.
+    """
+    root = CoverageNode()
+    nodes: List[CoverageNode] = []
+    keys: List[str] = []
+    array: Optional[List[Any]] = None
+
+    for __, event, value in events:
+        if array is not None:
+            if event == "end_array":
+                nodes[-1].add_value(keys[-1], array)
+                array = None
+            elif event in ("start_map", "start_array"):
+                err = f"Unsupported nested value in array '{keys[-1]}'."
+                raise ValueError(err)
+            else:
+                array.append(value)
+        elif event == "start_map":
+            nodes.append(nodes[-1].get_child(keys[-1]) if nodes else root)
+            keys.append("")
+        elif event == "end_map":
+            nodes.pop()
+            keys.pop()
+        elif event == "map_key":
+            keys[-1] = value
+        elif not nodes:
+            # the top-level value is not an object
+            break
+        elif event == "start_array":
+            array = []
+        else:
+            nodes[-1].add_value(keys[-1], value)
+
+    return root
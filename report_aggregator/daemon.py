@@ -0,0 +1,244 @@
+"""Long-running service that downloads and publishes new results as they appear."""
+
+import http
+import http.server
+import json
+import logging
+import signal
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from report_aggregator import artifacts_github
+from report_aggregator import consts
+from report_aggregator import coverage_publisher
+from report_aggregator import github_api
+from report_aggregator import nightly_github
+from report_aggregator import publisher
+from report_aggregator import state_index
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Daemon:
+    """Poll Github for new nightly results, publish reports and coverage."""
+
+    def __init__(
+        self,
+        base_dir: Path,
+        web_dir: Path,
+        coverage_web_dir: Optional[Path] = None,
+        coverage_daily_dump: bool = True,
+        timedelta_mins: int = consts.TIMEDELTA_MINS,
+        jobs: int = consts.DOWNLOAD_JOBS,
+        stream: bool = False,
+        tmp_base_dir: Optional[Path] = None,
+        min_interval: int = consts.SERVE_MIN_INTERVAL,
+        max_interval: int = consts.SERVE_MAX_INTERVAL,
+        publish_options: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.base_dir = base_dir
+        self.web_dir = web_dir
+        self.coverage_web_dir = coverage_web_dir
+        self.coverage_daily_dump = coverage_daily_dump
+        self.timedelta_mins = timedelta_mins
+        self.jobs = jobs
+        self.stream = stream
+        self.tmp_base_dir = tmp_base_dir
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.publish_options = publish_options or {}
+
+        self.interval = min_interval
+        self._coverage_files: Optional[List[Path]] = None
+        self._coverage_day = ""
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._status: Dict[str, Any] = {
+            "state": "starting",
+            "polls": 0,
+            "published_polls": 0,
+            "failed_polls": 0,
+            "last_poll_started": None,
+            "last_poll_finished": None,
+            "last_error": None,
+            "next_poll": None,
+        }
+
+    def _set_status(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._status.update(kwargs)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Return status of the service."""
+        rate_limiter = artifacts_github.get_rate_limiter()
+        with self._lock:
+            return {
+                **self._status,
+                "interval": self.interval,
+                "api_remaining": rate_limiter.remaining,
+                "api_limit": rate_limiter.limit,
+            }
+
+    def wake(self) -> None:
+        """Poll as soon as possible."""
+        self._wake.set()
+
+    def stop(self) -> None:
+        """Stop the service after the current poll."""
+        self._stop.set()
+        self._wake.set()
+
+    def publish_results(self) -> bool:
+        """Publish reports from new results, return True if there were any."""
+        if not state_index.StateIndex(base_dir=self.base_dir).get_new_results():
+            return False
+
+        self._set_status(state="publishing")
+        with tempfile.TemporaryDirectory(dir=self.tmp_base_dir) as tmp_dir:
+            publisher.publish(
+                new_results_base_dir=self.base_dir,
+                web_base_dir=self.web_dir,
+                results_tmp_dir=Path(tmp_dir) / "results",
+                **self.publish_options,
+            )
+        return True
+
+    def publish_coverage(self) -> bool:
+        """Publish coverage if the set of latest coverage files changed, or on a new day."""
+        if not self.coverage_web_dir:
+            return False
+
+        coverage_files = list(coverage_publisher.get_latest_coverage(base_dir=self.base_dir))
+        # the coverage trend (and the daily dump) gets an entry for each day
+        today = time.strftime("%Y%m%d")
+        if coverage_files == self._coverage_files and today == self._coverage_day:
+            return False
+
+        self._set_status(state="publishing coverage")
+        coverage_publisher.publish(
+            results_base_dir=self.base_dir,
+            web_dir=self.coverage_web_dir,
+            daily_dump=self.coverage_daily_dump,
+        )
+        self._coverage_files = coverage_files
+        self._coverage_day = today
+        return True
+
+    def poll(self, api: github_api.GithubApi) -> bool:
+        """Download new results and publish them, return True if anything was published."""
+        self._set_status(state="downloading", last_poll_started=time.time())
+        try:
+            nightly_github.download_nightly_results(
+                base_dir=self.base_dir,
+                timedelta_mins=self.timedelta_mins,
+                jobs=self.jobs,
+                stream=self.stream,
+                api=api,
+            )
+        except RuntimeError:
+            # failed artifacts are retried in the next poll, publish what was downloaded
+            LOGGER.exception("Failed to download some results")
+
+        published = self.publish_results()
+        published = self.publish_coverage() or published
+        return published
+
+    def _get_next_interval(self, published: bool) -> int:
+        rate_limiter = artifacts_github.get_rate_limiter()
+        if rate_limiter.remaining is not None and rate_limiter.remaining < rate_limiter.reserve:
+            return self.max_interval
+        if published:
+            return self.min_interval
+        return min(self.interval * 2, self.max_interval)
+
+    def run(self) -> None:
+        """Poll until stopped."""
+        # the API client, its cache and the HTTP connections are kept open between the polls
+        with github_api.get_api(base_dir=self.base_dir) as api:
+            while not self._stop.is_set():
+                self._wake.clear()
+                published = False
+                try:
+                    published = self.poll(api=api)
+                except Exception as exc:
+                    LOGGER.exception("Poll failed")
+                    with self._lock:
+                        self._status["failed_polls"] += 1
+                        self._status["last_error"] = f"{type(exc).__name__}: {exc}"
+
+                # back off while the polls bring no new results
+                self.interval = self._get_next_interval(published=published)
+                with self._lock:
+                    self._status["polls"] += 1
+                    self._status["published_polls"] += int(published)
+                    self._status.update(
+                        state="idle",
+                        last_poll_finished=time.time(),
+                        next_poll=time.time() + self.interval,
+                    )
+                LOGGER.info(f"Next poll in {self.interval}s")
+                self._wake.wait(timeout=self.interval)
+
+        self._set_status(state="stopped", next_poll=None)
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    """Handle requests to the status endpoint.
+
+    GET /status returns the status as JSON, POST /poll requests an immediate poll.
+    """
+
+    service: Daemon
+
+    def _send_json(self, status: http.HTTPStatus, data: Dict[str, Any]) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") in ("", "/status"):
+            self._send_json(status=http.HTTPStatus.OK, data=self.service.get_status())
+        else:
+            self._send_json(status=http.HTTPStatus.NOT_FOUND, data={"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") == "/poll":
+            self.service.wake()
+            self._send_json(status=http.HTTPStatus.ACCEPTED, data={"poll": "requested"})
+        else:
+            self._send_json(status=http.HTTPStatus.NOT_FOUND, data={"error": "not found"})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        LOGGER.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(daemon: Daemon, port: int = consts.SERVE_PORT) -> None:
+    """Run the service, with the status endpoint listening on localhost."""
+    handler = type("Handler", (StatusHandler,), {"service": daemon})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    LOGGER.info(f"Status endpoint listening on http://127.0.0.1:{server.server_address[1]}")
+
+    def _stop(signum: int, frame: Any) -> None:  # noqa: ARG001
+        LOGGER.info("Stopping after the current poll")
+        daemon.stop()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    try:
+        daemon.run()
+    finally:
+        server.shutdown()
+        server.server_close()
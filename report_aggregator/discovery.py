@@ -0,0 +1,107 @@
+"""Concurrent discovery of workflow runs and their artifacts."""
+
+import collections
+import concurrent.futures
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from report_aggregator import artifacts_github
+from report_aggregator import consts
+from report_aggregator import github_api
+
+GetRunsFunc = Callable[[Dict[str, Any]], Iterable[Dict[str, Any]]]
+SkipRunFunc = Callable[[Dict[str, Any]], bool]
+
+# (workflow, run) pair, the run is None until runs of the workflow are listed
+_Task = Tuple[Dict[str, Any], Optional[Dict[str, Any]]]
+
+
+class WorkItem(NamedTuple):
+    workflow: Dict[str, Any]
+    run: Dict[str, Any]
+    artifacts: List[Dict[str, Any]]
+
+
+def _list_runs(get_runs: GetRunsFunc, workflow: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return list(get_runs(workflow))
+
+
+def _list_artifacts(api: github_api.GithubApi, run: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return list(artifacts_github.get_run_artifacts(api=api, run=run))
+
+
+def _iter_tasks(
+    api: github_api.GithubApi,
+    tasks: Iterable[_Task],
+    get_runs: Optional[GetRunsFunc] = None,
+    skip_run: Optional[SkipRunFunc] = None,
+    jobs: int = consts.DISCOVERY_JOBS,
+) -> Generator[WorkItem, None, None]:
+    """Process the tasks on a thread pool, yield work items in the order they are discovered."""
+    jobs = max(jobs, 1)
+    queued: Deque[_Task] = collections.deque(tasks)
+    in_progress: Dict[concurrent.futures.Future, _Task] = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            while queued or in_progress:
+                # at most `jobs` requests are in progress, also while the consumer is busy
+                while queued and len(in_progress) < jobs:
+                    workflow, run = queued.popleft()
+                    if run is None:
+                        assert get_runs
+                        future = executor.submit(_list_runs, get_runs, workflow)
+                    else:
+                        future = executor.submit(_list_artifacts, api, run)
+                    in_progress[future] = (workflow, run)
+
+                done, __ = concurrent.futures.wait(
+                    in_progress, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    workflow, run = in_progress.pop(future)
+                    if run is None:
+                        # runs are listed first, their artifacts after all the workflows
+                        queued.extend(
+                            (workflow, r) for r in future.result() if not (skip_run and skip_run(r))
+                        )
+                    else:
+                        yield WorkItem(workflow=workflow, run=run, artifacts=future.result())
+        finally:
+            # the generator was closed, don't start the remaining requests
+            for future in in_progress:
+                future.cancel()
+
+
+def iter_work_items(
+    api: github_api.GithubApi,
+    workflows: Iterable[Dict[str, Any]],
+    get_runs: GetRunsFunc,
+    skip_run: Optional[SkipRunFunc] = None,
+    jobs: int = consts.DISCOVERY_JOBS,
+) -> Generator[WorkItem, None, None]:
+    """Yield runs of all the workflows together with the run artifacts, listed concurrently."""
+    return _iter_tasks(
+        api=api,
+        tasks=((w, None) for w in workflows),
+        get_runs=get_runs,
+        skip_run=skip_run,
+        jobs=jobs,
+    )
+
+
+def iter_run_artifacts(
+    api: github_api.GithubApi,
+    runs: Iterable[Tuple[Dict[str, Any], Dict[str, Any]]],
+    jobs: int = consts.DISCOVERY_JOBS,
+) -> Generator[WorkItem, None, None]:
+    """Yield the (workflow, run) pairs together with the run artifacts, listed concurrently."""
+    return _iter_tasks(api=api, tasks=runs, jobs=jobs)
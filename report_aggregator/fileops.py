@@ -0,0 +1,88 @@
+"""Copy files without duplicating data where possible."""
+
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any
+
+# ioctl request number of FICLONE from linux/fs.h
+FICLONE = 0x40049409
+
+
+def _reflink(src: str, dst: str) -> None:
+    with open(src, "rb") as src_fp, open(dst, "wb") as dst_fp:
+        fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+
+
+def copy_file(src: str, dst: str, *, follow_symlinks: bool = True) -> str:
+    """Copy file, sharing the data with the source file if possible.
+
+    Use reflink (copy-on-write clone) if the filesystem supports it, hardlink when source and
+    destination are on the same filesystem, and regular copy otherwise. Hardlinked files must
+    never be modified in place, see `write_text`.
+
+    The signature is compatible with `shutil.copy2`, so it can be used as `copy_function`.
+    """
+    src_path = Path(src)
+    dst_path = Path(dst)
+    if dst_path.is_dir():
+        dst_path = dst_path / src_path.name
+    # the existing file can be a hardlink, it must not be overwritten in place
+    dst_path.unlink(missing_ok=True)
+
+    if follow_symlinks or not src_path.is_symlink():
+        try:
+            _reflink(src=src, dst=str(dst_path))
+        except OSError:
+            dst_path.unlink(missing_ok=True)
+        else:
+            shutil.copystat(src, dst_path)
+            return str(dst_path)
+
+        try:
+            os.link(src, dst_path)
+        except OSError as exc:
+            if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+        else:
+            return str(dst_path)
+
+    return str(shutil.copy2(src, dst_path, follow_symlinks=follow_symlinks))
+
+
+def copytree(src: Path, dst: Path, **kwargs: Any) -> Path:
+    """Copy directory tree, sharing data of the files with the source where possible."""
+    return Path(shutil.copytree(src, dst, symlinks=True, copy_function=copy_file, **kwargs))
+
+
+def write_text(path: Path, text: str) -> None:
+    """Write text file by replacing it.
+
+    The file can be a hardlink created by `copy_file`, and the other links must not be affected.
+    """
+    try:
+        mode = path.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=path.parent, prefix=f".{path.name}.", delete=False
+    ) as out_fp:
+        out_fp.write(text)
+    tmp_path = Path(out_fp.name)
+    # temporary files are created readable only by the owner
+    tmp_path.chmod(mode)
+    tmp_path.replace(path)
+
+
+def get_file_digest(path: Path, algorithm: str = "sha256") -> str:
+    """Return hex digest of the file contents."""
+    hash_obj = hashlib.new(algorithm)
+    with open(path, "rb") as in_fp:
+        for chunk in iter(lambda: in_fp.read(1024 * 1024), b""):
+            hash_obj.update(chunk)
+    return hash_obj.hexdigest()
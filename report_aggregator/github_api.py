@@ -0,0 +1,252 @@
+"""Minimal Github REST API client with a persistent cache."""
+
+import contextlib
+import datetime
+import http
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Generator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import requests
+
+from report_aggregator import artifacts_github
+from report_aggregator import consts
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_FILE_NAME = ".github_cache.sqlite"
+# cached responses that were not used for this long are removed
+RESPONSES_MAX_AGE = 24 * 3600
+RESPONSES_PRUNE_INTERVAL = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    body TEXT NOT NULL,
+    next_url TEXT NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_by_use ON responses (used_at);
+CREATE TABLE IF NOT EXISTS done_runs (
+    run_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    index_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_key ON runs (index_key, created_at);
+CREATE TABLE IF NOT EXISTS run_indexes (
+    index_key TEXT PRIMARY KEY,
+    covered_from TEXT NOT NULL,
+    synced_from TEXT NOT NULL
+);
+"""
+
+
+def parse_time(timestamp: str) -> datetime.datetime:
+    """Parse timestamp returned by Github API (e.g. '2024-01-31T02:03:04Z')."""
+    return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def format_time(time: datetime.datetime) -> str:
+    """Format time the way Github API does (e.g. '2024-01-31T02:03:04Z')."""
+    return time.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class GithubApi:
+    """Github REST API client with a persistent cache of responses and workflow runs."""
+
+    def __init__(self, cache_file: Optional[Path] = None, api_url: str = consts.API_URL) -> None:
+        self.api_url = api_url
+        self.session = artifacts_github.get_session()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            str(cache_file) if cache_file else ":memory:", check_same_thread=False
+        )
+        with self._lock, self._db:
+            columns = {r[1] for r in self._db.execute("PRAGMA table_info(responses)")}
+            if columns and "used_at" not in columns:
+                # the table is just a cache, recreate it with the current schema
+                self._db.execute("DROP TABLE responses")
+            self._db.executescript(_SCHEMA)
+        self._pruned_at = 0.0
+        self._prune_cached()
+
+    def close(self) -> None:
+        """Close the cache database."""
+        with self._lock:
+            self._db.close()
+
+    def _prune_cached(self) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            # e.g. run listings filtered by creation time are requested only until newer runs
+            # appear, and artifacts of a run only until the run is done
+            self._db.execute("DELETE FROM responses WHERE used_at < ?", (now - RESPONSES_MAX_AGE,))
+        self._pruned_at = now
+
+    def _touch_cached(self, url: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("UPDATE responses SET used_at = ? WHERE url = ?", (time.time(), url))
+
+    def _get_cached(self, url: str) -> Optional[Tuple[str, str, str]]:
+        with self._lock:
+            row: Optional[Tuple[str, str, str]] = self._db.execute(
+                "SELECT etag, body, next_url FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        return row
+
+    def _set_cached(self, url: str, etag: str, body: str, next_url: str) -> None:
+        if time.time() - self._pruned_at > RESPONSES_PRUNE_INTERVAL:
+            self._prune_cached()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, body, next_url, used_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, etag, body, next_url, time.time()),
+            )
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> Tuple[Any, str]:
+        """Return decoded JSON response and URL of the next page (if any)."""
+        if "://" not in url:
+            url = f"{self.api_url}/{url.lstrip('/')}"
+        prepared_url = self.session.prepare_request(requests.Request("GET", url, params=params)).url
+        assert prepared_url
+
+        cached = self._get_cached(url=prepared_url)
+        # "304 Not Modified" responses don't count against the API rate limit
+        headers = {"If-None-Match": cached[0]} if cached else {}
+
+        with self.session.get(prepared_url, headers=headers, timeout=consts.HTTP_TIMEOUT) as r:
+            if cached and r.status_code == http.HTTPStatus.NOT_MODIFIED:
+                LOGGER.debug(f"Not modified: {prepared_url}")
+                self._touch_cached(url=prepared_url)
+                return json.loads(cached[1]), cached[2]
+
+            r.raise_for_status()
+            next_url = r.links.get("next", {}).get("url", "")
+            etag = r.headers.get("ETag")
+            if etag:
+                self._set_cached(url=prepared_url, etag=etag, body=r.text, next_url=next_url)
+            return r.json(), next_url
+
+    def get_paginated(
+        self, url: str, key: str, params: Optional[Dict[str, Any]] = None
+    ) -> Generator[Dict[str, Any], None, None]:
+        """Yield items of a paginated listing, fetching the next page only when needed."""
+        page_url = url
+        page_params: Optional[Dict[str, Any]] = {"per_page": 100, **(params or {})}
+        while page_url:
+            data, page_url = self.get(url=page_url, params=page_params)
+            # the URL of the next page already contains all the parameters
+            page_params = None
+            yield from data[key]
+
+    def _update_run_index(
+        self, url: str, index_key: str, created_from: str, params: Dict[str, Any]
+    ) -> None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT covered_from, synced_from FROM run_indexes WHERE index_key = ?",
+                (index_key,),
+            ).fetchone()
+        covered_from, synced_from = row or (created_from, created_from)
+        if created_from < covered_from:
+            # runs older than what is already indexed are needed
+            covered_from = synced_from = created_from
+
+        runs = list(
+            self.get_paginated(
+                url=url, key="workflow_runs", params={**params, "created": f">={synced_from}"}
+            )
+        )
+
+        # next time, start from the oldest run that is still not completed (its status will
+        # change), or from the newest run
+        pending = [r["created_at"] for r in runs if r["status"] != "completed"]
+        if pending:
+            synced_from = min(pending)
+        elif runs:
+            synced_from = max(synced_from, *(r["created_at"] for r in runs))
+
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO runs "
+                "(run_id, index_key, name, status, created_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (r["id"], index_key, r["name"], r["status"], r["created_at"], json.dumps(r))
+                    for r in runs
+                ),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO run_indexes (index_key, covered_from, synced_from) "
+                "VALUES (?, ?, ?)",
+                (index_key, covered_from, synced_from),
+            )
+        LOGGER.debug(f"Indexed {len(runs)} runs of '{index_key}' since {synced_from}")
+
+    def get_indexed_runs(
+        self,
+        url: str,
+        created_from: datetime.datetime,
+        params: Optional[Dict[str, Any]] = None,
+        name_contains: str = "",
+    ) -> List[Dict[str, Any]]:
+        """Return completed runs from a workflow runs listing, newest first."""
+        if "://" not in url:
+            url = f"{self.api_url}/{url.lstrip('/')}"
+        params = params or {}
+        index_key = self.session.prepare_request(requests.Request("GET", url, params=params)).url
+        assert index_key
+        created_from_str = format_time(time=created_from)
+
+        # only runs created since the last update are requested, usually in a single request
+        self._update_run_index(
+            url=url, index_key=index_key, created_from=created_from_str, params=params
+        )
+
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM runs WHERE index_key = ? AND created_at >= ? "
+                "AND status = 'completed' AND instr(name, ?) > 0 "
+                "ORDER BY created_at DESC, run_id DESC",
+                (index_key, created_from_str, name_contains),
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def is_run_done(self, run_id: int) -> bool:
+        """Check if the run was already fully processed."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT run_id FROM done_runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return row is not None
+
+    def mark_run_done(self, run_id: int) -> None:
+        """Record that the run was fully processed."""
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO done_runs (run_id) VALUES (?)", (run_id,))
+
+
+@contextlib.contextmanager
+def get_api(base_dir: Path) -> Generator[GithubApi, None, None]:
+    """Return Github API client with cache stored in the results base dir."""
+    api = GithubApi(cache_file=base_dir / CACHE_FILE_NAME)
+    try:
+        yield api
+    finally:
+        api.close()
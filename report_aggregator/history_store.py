@@ -0,0 +1,86 @@
+"""Store of Allure report history, one per `Job`."""
+
+import json
+import logging
+import shutil
+from pathlib import Path
+from typing import Any
+from typing import Optional
+
+from report_aggregator import consts
+from report_aggregator import fileops
+
+LOGGER = logging.getLogger(__name__)
+
+HISTORY_FILE_NAME = "history.json"
+
+
+def trim_history_file(history_file: Path, keep: int = consts.HISTORY_KEEP) -> Any:
+    """Return content of the history file with only the `keep` newest entries.
+
+    The trend files are lists of builds, the history file holds a list of results
+    for each test. The newest entries come first in both.
+    """
+    with open(history_file, encoding="utf-8") as in_fp:
+        history = json.load(in_fp)
+
+    if isinstance(history, list):
+        return history[:keep]
+
+    if history_file.name == HISTORY_FILE_NAME and isinstance(history, dict):
+        for test_history in history.values():
+            items = test_history.get("items") if isinstance(test_history, dict) else None
+            if isinstance(items, list):
+                test_history["items"] = items[:keep]
+
+    return history
+
+
+def seed(history_dir: Path, prev_report_dir: Path) -> None:
+    """Initialize the store from history of the previously published report."""
+    prev_history_dir = prev_report_dir / "history"
+    if history_dir.exists() or not prev_history_dir.is_dir():
+        return
+
+    LOGGER.info(f"Seeding history store '{history_dir}' from '{prev_history_dir}'")
+    history_dir.parent.mkdir(parents=True, exist_ok=True)
+    fileops.copytree(prev_history_dir, history_dir)
+
+
+def checkout(history_dir: Path, results_dir: Path) -> None:
+    """Make the stored history available to Allure in the results dir."""
+    results_history_dir = results_dir / "history"
+    shutil.rmtree(results_history_dir, ignore_errors=True)
+    if history_dir.is_dir():
+        fileops.copytree(history_dir, results_history_dir)
+
+
+def stage(history_dir: Path, report_dir: Path, keep: int = consts.HISTORY_KEEP) -> Optional[Path]:
+    """Write history of the newly generated report, trimmed to `keep` entries, to a staging dir.
+
+    Return the staging dir, or None when the report has no history. The store is not
+    modified until the staged history is committed. The history is kept in the report
+    as well.
+    """
+    report_history_dir = report_dir / "history"
+    if not report_history_dir.is_dir():
+        return None
+
+    staged_dir = history_dir.with_name(f".{history_dir.name}.staged")
+    shutil.rmtree(staged_dir, ignore_errors=True)
+    staged_dir.mkdir(parents=True)
+    for history_file in report_history_dir.glob("*.json"):
+        history = trim_history_file(history_file=history_file, keep=keep)
+        fileops.write_text(path=staged_dir / history_file.name, text=json.dumps(history))
+
+    return staged_dir
+
+
+def commit(history_dir: Path, staged_dir: Path) -> None:
+    """Replace history in the store with the staged history."""
+    old_dir = staged_dir.with_name(f"{staged_dir.name}.old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if history_dir.exists():
+        history_dir.rename(old_dir)
+    staged_dir.rename(history_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
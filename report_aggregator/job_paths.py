@@ -0,0 +1,81 @@
+"""Job records derived from paths of results."""
+
+from pathlib import Path
+from typing import NamedTuple
+
+from report_aggregator import consts
+
+
+class Job(NamedTuple):
+    job_name: str
+    revision: str
+    build_id: str
+    step: str
+
+
+def get_job_from_results(results_path: Path, base_dir: Path) -> Job:
+    """Return a `Job` record derived from results dir or archive file path.
+
+    E.g.
+    * 'nightly/506/allure-results.tar.xz' ->
+        Job(job_name='nightly', revision='', build_id='506', step='')
+    * 'babbage_dbsync/40458eefa87c7c3abd8c6ba542d9e931d8b2ecb8/1664632102/allure-results' ->
+        Job(job_name='babbage_dbsync', revision='40458eefa87c7c3abd8c6ba542d9e931d8b2ecb8',
+            build_id='1664632102', step='')
+    * 'nightly-upgrade/506/step1/allure-results.tar.xz' ->
+        Job(job_name='nightly', revision='', build_id='506', step="step1")
+    """
+    steps_path = results_path.parent
+    step = steps_path.name
+    if not steps_path.name.startswith(consts.STEPS_BASE):
+        steps_path = results_path
+        step = ""
+    build_id_path = steps_path.parent
+    revision_path = build_id_path.parent
+    job_path = revision_path.parent
+
+    revision = revision_path.name
+    # check if there is a "revision" component in the file path
+    if job_path == base_dir:
+        job_path = revision_path
+        revision = ""
+
+    return Job(job_name=job_path.name, revision=revision, build_id=build_id_path.name, step=step)
+
+
+def get_job_from_tree(inner_dir: Path, base_dir: Path) -> Job:
+    """Return a `Job` record derived from dir tree.
+
+    E.g.
+    * 'nightly -> Job(job_name='nightly', revision='', build_id='')
+    * 'babbage_dbsync/40458eefa87c7c3abd8c6ba542d9e931d8b2ecb8' ->
+        Job(job_name='babbage_dbsync', revision='40458eefa87c7c3abd8c6ba542d9e931d8b2ecb8',
+            build_id='', step='')
+    * 'nightly-upgrade/step1' ->
+        Job(job_name='nightly-upgrade', revision='', build_id='', step="step1")
+    """
+    revision_path = inner_dir
+    step = ""
+    if inner_dir.name.startswith(consts.STEPS_BASE):
+        step = inner_dir.name
+        revision_path = inner_dir.parent
+    job_path = revision_path.parent
+
+    revision = revision_path.name
+    # check if there is a "revision" component in the file path
+    if job_path == base_dir:
+        job_path = revision_path
+        revision = ""
+
+    return Job(job_name=job_path.name, revision=revision, build_id="", step=step)
+
+
+def get_results_path(dest_dir: Path) -> Path:
+    """Return path to results in the dir where results artifact was downloaded.
+
+    Results that were already unpacked while downloading take precedence over the archive.
+    """
+    results_dir = dest_dir / consts.REPORTS_DIRNAME
+    if results_dir.is_dir():
+        return results_dir
+    return dest_dir / consts.REPORTS_ARCHIVE
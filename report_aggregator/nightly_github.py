@@ -1,17 +1,19 @@
 """Download nightly testing results from Github."""
 
+import contextlib
 import datetime
 import logging
 from pathlib import Path
+from typing import Any
+from typing import Dict
 from typing import Generator
-
-import github
-from github import Repository as GRepository
-from github import Workflow as GWorkflow
-from github import WorkflowRun as GWorkflowRun
+from typing import Optional
 
 from report_aggregator import artifacts_github
 from report_aggregator import consts
+from report_aggregator import discovery
+from report_aggregator import github_api
+from report_aggregator import state_index
 
 LOGGER = logging.getLogger(__name__)
 
@@ -26,71 +28,135 @@ def get_slug(name: str) -> str:
 
 
 def get_workflows(
-    repo_obj: GRepository.Repository,
-) -> Generator[GWorkflow.Workflow, None, None]:
+    api: github_api.GithubApi, repo_slug: str
+) -> Generator[Dict[str, Any], None, None]:
     """Return active nightly workflows."""
-    workflows = (w for w in repo_obj.get_workflows() if NAME_BASE in w.name and w.state == "active")
+    workflows = (
+        w
+        for w in api.get_paginated(url=f"repos/{repo_slug}/actions/workflows", key="workflows")
+        if NAME_BASE in w["name"] and w["state"] == "active"
+    )
     return workflows
 
 
 def get_runs(
-    workflow: GWorkflow.Workflow, started_from: datetime.datetime
-) -> Generator[GWorkflowRun.WorkflowRun, None, None]:
+    api: github_api.GithubApi, workflow: Dict[str, Any], started_from: datetime.datetime
+) -> Generator[Dict[str, Any], None, None]:
     """Return recent runs for a workflow."""
-    for r in workflow.get_runs(branch="master", event="schedule", status="completed"):
-        if r.created_at < started_from:
+    for r in api.get_paginated(
+        url=f"{workflow['url']}/runs",
+        key="workflow_runs",
+        params={"branch": "master", "event": "schedule", "status": "completed"},
+    ):
+        if github_api.parse_time(r["created_at"]) < started_from:
             return
         yield r
 
 
+def get_run_tasks(
+    api: github_api.GithubApi, work_item: discovery.WorkItem, base_dir: Path
+) -> Generator[artifacts_github.ArtifactTask, None, None]:
+    """Return artifacts that need to be processed for a nightly run."""
+    cur_run = work_item.run
+    run_num = cur_run["run_number"] + RUN_OFFSET
+    dest_dir = base_dir / get_slug(name=work_item.workflow["name"]) / str(run_num)
+    LOGGER.info(f"Processing run: {work_item.workflow['name']} {cur_run['run_number']} ({run_num})")
+
+    result_artifacts = list(
+        artifacts_github.get_result_artifacts(run_artifacts=work_item.artifacts)
+    )
+    has_steps = result_artifacts and ("step" in result_artifacts[0]["name"])
+
+    if len(result_artifacts) > 1 and not has_steps:
+        LOGGER.warning("Skipping run with unexpected artifacts")
+        api.mark_run_done(run_id=cur_run["id"])
+        return
+
+    run_tasks = []
+    for result_artifact in result_artifacts:
+        a_dest_dir = dest_dir
+        if has_steps:
+            step_id = artifacts_github.get_step_id(artifact_name=result_artifact["name"])
+            a_dest_dir = dest_dir / step_id
+
+        run_tasks.append(
+            artifacts_github.get_artifact_task(artifact=result_artifact, dest_dir=a_dest_dir)
+        )
+
+    coverage_artifacts = list(
+        artifacts_github.get_coverage_artifacts(run_artifacts=work_item.artifacts)
+    )
+    # all coverage artifacts share the same `.downloaded_cov` marker, so only the first
+    # one is ever used
+    run_tasks.extend(
+        artifacts_github.get_artifact_task(
+            artifact=cov_artifact, dest_dir=dest_dir, is_coverage=True
+        )
+        for cov_artifact in coverage_artifacts[:1]
+    )
+
+    # the run is done once all its artifacts were downloaded in some of the previous runs;
+    # it is marked only after the consumer had a chance to record them in the state index
+    is_done = all(artifacts_github.is_task_done(t) for t in run_tasks)
+    yield from run_tasks
+    if is_done:
+        api.mark_run_done(run_id=cur_run["id"])
+
+
+def get_artifact_tasks(
+    api: github_api.GithubApi, repo_slug: str, base_dir: Path, started_from: datetime.datetime
+) -> Generator[artifacts_github.ArtifactTask, None, None]:
+    """Return artifacts that need to be processed for all recent nightly runs.
+
+    Runs and artifacts of all the workflows are searched for concurrently, the tasks are
+    returned as soon as the artifacts of a run are known.
+    """
+    workflows = list(get_workflows(api=api, repo_slug=repo_slug))
+    for workflow in workflows:
+        LOGGER.info(f"Processing workflow: {workflow['name']} ({get_slug(name=workflow['name'])})")
+
+    def _is_run_done(run: Dict[str, Any]) -> bool:
+        if api.is_run_done(run_id=run["id"]):
+            LOGGER.debug(f"Skipping already processed run: {run['run_number']}")
+            return True
+        return False
+
+    for work_item in discovery.iter_work_items(
+        api=api,
+        workflows=workflows,
+        get_runs=lambda w: get_runs(api=api, workflow=w, started_from=started_from),
+        skip_run=_is_run_done,
+    ):
+        yield from get_run_tasks(api=api, work_item=work_item, base_dir=base_dir)
+
+
 def download_nightly_results(
-    base_dir: Path, repo_slug: str = consts.REPO_SLUG, timedelta_mins: int = consts.TIMEDELTA_MINS
+    base_dir: Path,
+    repo_slug: str = consts.REPO_SLUG,
+    timedelta_mins: int = consts.TIMEDELTA_MINS,
+    jobs: int = consts.DOWNLOAD_JOBS,
+    stream: bool = False,
+    api: Optional[github_api.GithubApi] = None,
 ) -> None:
-    """Download results from all recent nightly jobs."""
-    github_obj = github.Github(auth=github.Auth.Token(consts.GITHUB_TOKEN))
-    repo_obj = github_obj.get_repo(repo_slug)
+    """Download results from all recent nightly jobs.
+
+    An already open Github API client can be passed in `api`, e.g. to reuse it across runs.
+    """
     started_from = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(
         minutes=timedelta_mins
     )
 
-    for workflow in get_workflows(repo_obj=repo_obj):
-        workflow_slug = get_slug(name=workflow.name)
-        LOGGER.info(f"Processing workflow: {workflow.name} ({workflow_slug})")
-
-        for cur_run in get_runs(workflow=workflow, started_from=started_from):
-            run_num = cur_run.run_number + RUN_OFFSET
-            dest_dir = base_dir / workflow_slug / str(run_num)
-            LOGGER.info(f"Processing run: {cur_run.run_number} ({run_num})")
-
-            run_artifacts = list(artifacts_github.get_run_artifacts(run=cur_run))
-
-            result_artifacts = list(
-                artifacts_github.get_result_artifacts(run_artifacts=run_artifacts)
-            )
-            has_steps = result_artifacts and ("step" in result_artifacts[0].name)
-
-            if len(result_artifacts) > 1 and not has_steps:
-                LOGGER.warning("Skipping run with unexpected artifacts")
-                continue
-
-            for result_artifact in result_artifacts:
-                a_dest_dir = dest_dir
-                if has_steps:
-                    step_id = result_artifact.name[len(consts.RESULTS_ARTIFACT_NAME) :].lstrip("-")
-                    a_dest_dir = dest_dir / step_id
-                a_dest_dir.mkdir(parents=True, exist_ok=True)
-
-                artifacts_github.process_result_artifact(
-                    dest_dir=a_dest_dir, download_url=result_artifact.archive_download_url
-                )
-
-            coverage_artifacts = list(
-                artifacts_github.get_coverage_artifacts(run_artifacts=run_artifacts)
-            )
-            if coverage_artifacts:
-                dest_dir.mkdir(parents=True, exist_ok=True)
-
-            for cov_artifact in coverage_artifacts:
-                artifacts_github.process_coverage_artifact(
-                    dest_dir=dest_dir, download_url=cov_artifact.archive_download_url
-                )
+    api_cm = contextlib.nullcontext(api) if api else github_api.get_api(base_dir=base_dir)
+    with api_cm as cur_api:
+        failed = artifacts_github.download_artifacts(
+            tasks=get_artifact_tasks(
+                api=cur_api, repo_slug=repo_slug, base_dir=base_dir, started_from=started_from
+            ),
+            jobs=jobs,
+            stream=stream,
+            index=state_index.StateIndex(base_dir=base_dir),
+        )
+    artifacts_github.get_rate_limiter().log_usage()
+    if failed:
+        err = f"Failed to process {failed} artifact(s)."
+        raise RuntimeError(err)
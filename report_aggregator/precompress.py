@@ -0,0 +1,187 @@
+"""Precompress static files of published reports, so web server can serve them as they are."""
+
+import concurrent.futures
+import gzip
+import hashlib
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+from typing import IO
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+
+from report_aggregator import consts
+from report_aggregator import fileops
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOGGER = logging.getLogger(__name__)
+
+COMPRESSIBLE_SUFFIXES = (
+    ".css",
+    ".csv",
+    ".html",
+    ".js",
+    ".json",
+    ".log",
+    ".svg",
+    ".txt",
+    ".xml",
+)
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _BrotliWriter:
+    """Writable file-like object that compresses data with brotli."""
+
+    def __init__(self, out_fp: IO[bytes]) -> None:
+        self.out_fp = out_fp
+        self.compressor = brotli.Compressor()
+
+    def write(self, data: bytes) -> int:
+        self.out_fp.write(self.compressor.process(data))
+        return len(data)
+
+    def close(self) -> None:
+        self.out_fp.write(self.compressor.finish())
+
+
+def _open_gz(out_fp: IO[bytes]) -> Any:
+    # no name and timestamp in the header, so the same file always gives the same output
+    return gzip.GzipFile(filename="", mode="wb", fileobj=out_fp, compresslevel=9, mtime=0)
+
+
+def _open_br(out_fp: IO[bytes]) -> Any:
+    return _BrotliWriter(out_fp=out_fp)
+
+
+def _iter_gz(in_fp: IO[bytes]) -> Iterator[bytes]:
+    with gzip.GzipFile(mode="rb", fileobj=in_fp) as gz_fp:
+        yield from iter(lambda: gz_fp.read(CHUNK_SIZE), b"")
+
+
+def _iter_br(in_fp: IO[bytes]) -> Iterator[bytes]:
+    decompressor = brotli.Decompressor()
+    for chunk in iter(lambda: in_fp.read(CHUNK_SIZE), b""):
+        yield decompressor.process(chunk)
+
+
+# writers that compress data written to the output file
+COMPRESSORS: Dict[str, Callable[[IO[bytes]], Any]] = {
+    "gz": _open_gz,
+    "br": _open_br,
+}
+# readers of decompressed data from the input file
+DECOMPRESSORS: Dict[str, Callable[[IO[bytes]], Iterator[bytes]]] = {
+    "gz": _iter_gz,
+    "br": _iter_br,
+}
+
+
+def get_formats(formats: Iterable[str]) -> List[str]:
+    """Return the compression formats that are available."""
+    available = []
+    for fmt in formats:
+        if fmt == "br" and brotli is None:
+            LOGGER.warning("The 'brotli' package is not installed, skipping '.br' files")
+            continue
+        available.append(fmt)
+    return available
+
+
+def is_compressible(file: Path, min_size: int = consts.PRECOMPRESS_MIN_SIZE) -> bool:
+    """Check if the file is worth compressing."""
+    return (
+        file.suffix in COMPRESSIBLE_SUFFIXES
+        and file.is_file()
+        and not file.is_symlink()
+        and file.stat().st_size >= min_size
+    )
+
+
+def _write_compressed(file: Path, out_fp: IO[bytes], fmt: str) -> None:
+    writer = COMPRESSORS[fmt](out_fp)
+    with open(file, "rb") as in_fp:
+        shutil.copyfileobj(in_fp, writer, CHUNK_SIZE)
+    writer.close()
+
+
+def get_decompressed_digest(compressed_file: Path, fmt: str) -> str:
+    """Return digest of the decompressed content, or empty string if it can't be decompressed."""
+    hash_obj = hashlib.sha256()
+    try:
+        with open(compressed_file, "rb") as in_fp:
+            for chunk in DECOMPRESSORS[fmt](in_fp):
+                hash_obj.update(chunk)
+    except Exception:
+        return ""
+    return hash_obj.hexdigest()
+
+
+def compress_file(file: Path, formats: Iterable[str] = consts.PRECOMPRESS_FORMATS) -> int:
+    """Write compressed siblings of the file (e.g. 'app.js.gz').
+
+    Siblings that decompress to the content of the file are current and are not written
+    again. The data are compressed in chunks, big files are never loaded into memory.
+    Return number of written files.
+    """
+    file_digest = ""
+    written = 0
+
+    for fmt in formats:
+        compressed_file = file.with_name(f"{file.name}.{fmt}")
+        if compressed_file.exists():
+            file_digest = file_digest or fileops.get_file_digest(path=file)
+            if get_decompressed_digest(compressed_file=compressed_file, fmt=fmt) == file_digest:
+                continue
+
+        with tempfile.NamedTemporaryFile(
+            dir=file.parent, prefix=f".{compressed_file.name}.", delete=False
+        ) as out_fp:
+            _write_compressed(file=file, out_fp=out_fp, fmt=fmt)
+        tmp_file = Path(out_fp.name)
+        tmp_file.chmod(file.stat().st_mode & 0o777)
+        tmp_file.replace(compressed_file)
+        written += 1
+
+    return written
+
+
+def compress_dir(
+    base_dir: Path,
+    formats: Iterable[str] = consts.PRECOMPRESS_FORMATS,
+    min_size: int = consts.PRECOMPRESS_MIN_SIZE,
+    jobs: int = consts.PRECOMPRESS_JOBS,
+    exclude: Iterable[str] = (),
+) -> int:
+    """Write compressed siblings of all compressible files in the dir tree, in parallel.
+
+    Top-level entries listed in `exclude` are skipped. Return number of written files.
+    """
+    formats = get_formats(formats=formats)
+    if not formats:
+        return 0
+
+    exclude = set(exclude)
+    files = [
+        f
+        for f in base_dir.rglob("*")
+        if f.relative_to(base_dir).parts[0] not in exclude
+        and is_compressible(file=f, min_size=min_size)
+    ]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        written = sum(executor.map(lambda f: compress_file(file=f, formats=formats), files))
+
+    LOGGER.debug(f"Written {written} compressed files: {base_dir}")
+    return written
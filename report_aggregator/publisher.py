@@ -1,97 +1,218 @@
 """Publish the reports to the web."""
 
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
 import json
 import logging
+import os
 import shutil
 import subprocess
 import tarfile
+import threading
+import time
 from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
 from typing import Generator
 from typing import Iterable
 from typing import List
 from typing import NamedTuple
-from typing import Set
+from typing import Optional
 from typing import Tuple
 
+from report_aggregator import attachment_store
 from report_aggregator import consts
+from report_aggregator import fileops
+from report_aggregator import history_store
+from report_aggregator import job_paths
+from report_aggregator import precompress
+from report_aggregator import results_index
+from report_aggregator import state_index
 
 LOGGER = logging.getLogger(__name__)
 
+# serializes creation of the JVM class data sharing archive
+_CDS_LOCK = threading.Lock()
 
-class Job(NamedTuple):
-    job_name: str
-    revision: str
-    build_id: str
-    step: str
 
+class StagedResults(NamedTuple):
+    results_dir: Path
+    sources: List[Path]  # new results the dir was staged from
 
-def cli(cli_args: Iterable[str]) -> Tuple[str, str]:
-    """Run CLI command."""
-    assert not isinstance(cli_args, str), "`cli_args` must be sequence of strings"
-    with subprocess.Popen(list(cli_args), stdout=subprocess.PIPE, stderr=subprocess.PIPE) as p:
-        stdout, stderr = p.communicate()
-    # pyrefly: ignore  # missing-attribute
-    return stdout.decode("utf-8"), stderr.decode("utf-8")
 
+class ReportBuild(NamedTuple):
+    web_dir: Path
+    report_dir: Path
+    history_dir: Path
+    inputs: Dict[str, str]
 
-def get_job_from_results(results_path: Path, base_dir: Path) -> Job:
-    """Return a `Job` record derived from results dir or archive file path.
-
-    E.g.
-    * 'nightly/506/allure-results.tar.xz' ->
-        Job(job_name='nightly', revision='', build_id='506', step='')
-    * 'babbage_dbsync/40458eefa87c7c3abd8c6ba542d9e931d8b2ecb8/1664632102/allure-results' ->
-        Job(job_name='babbage_dbsync', revision='40458eefa87c7c3abd8c6ba542d9e931d8b2ecb8',
-            build_id='1664632102', step='')
-    * 'nightly-upgrade/506/step1/allure-results.tar.xz' ->
-        Job(job_name='nightly', revision='', build_id='506', step="step1")
-    """
-    steps_path = results_path.parent
-    step = steps_path.name
-    if not steps_path.name.startswith(consts.STEPS_BASE):
-        steps_path = results_path
-        step = ""
-    build_id_path = steps_path.parent
-    revision_path = build_id_path.parent
-    job_path = revision_path.parent
-
-    revision = revision_path.name
-    # check if there is a "revision" component in the file path
-    if job_path == base_dir:
-        job_path = revision_path
-        revision = ""
-
-    return Job(job_name=job_path.name, revision=revision, build_id=build_id_path.name, step=step)
-
-
-def get_job_from_tree(inner_dir: Path, base_dir: Path) -> Job:
-    """Return a `Job` record derived from dir tree.
-
-    E.g.
-    * 'nightly -> Job(job_name='nightly', revision='', build_id='')
-    * 'babbage_dbsync/40458eefa87c7c3abd8c6ba542d9e931d8b2ecb8' ->
-        Job(job_name='babbage_dbsync', revision='40458eefa87c7c3abd8c6ba542d9e931d8b2ecb8',
-            build_id='', step='')
-    * 'nightly-upgrade/step1' ->
-        Job(job_name='nightly-upgrade', revision='', build_id='', step="step1")
-    """
-    revision_path = inner_dir
-    step = ""
-    if inner_dir.name.startswith(consts.STEPS_BASE):
-        step = inner_dir.name
-        revision_path = inner_dir.parent
-    job_path = revision_path.parent
-
-    revision = revision_path.name
-    # check if there is a "revision" component in the file path
-    if job_path == base_dir:
-        job_path = revision_path
-        revision = ""
 
-    return Job(job_name=job_path.name, revision=revision, build_id="", step=step)
+def cli(cli_args: Iterable[str], env: Optional[Dict[str, str]] = None) -> Tuple[str, str]:
+    """Run CLI command, raise `subprocess.CalledProcessError` if it fails."""
+    assert not isinstance(cli_args, str), "`cli_args` must be sequence of strings"
+    cli_args = list(cli_args)
+    with subprocess.Popen(cli_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env) as p:
+        stdout, stderr = p.communicate()
+    # pyrefly: ignore  # missing-attribute
+    stdout_str, stderr_str = stdout.decode("utf-8"), stderr.decode("utf-8")
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(
+            returncode=p.returncode, cmd=cli_args, output=stdout_str, stderr=stderr_str
+        )
+    return stdout_str, stderr_str
+
+
+class ReportScheduler:
+    """Generate reports with Allure and publish them, on a bounded pool of workers each."""
+
+    def __init__(
+        self,
+        results_base_dir: Path,
+        web_base_dir: Path,
+        jobs: int = consts.ALLURE_JOBS,
+        java_heap: str = consts.ALLURE_HEAP,
+        jvm_cache_dir: Optional[Path] = None,
+        history_keep: int = consts.HISTORY_KEEP,
+        compress_formats: Iterable[str] = consts.PRECOMPRESS_FORMATS,
+        web_jobs: int = consts.WEB_JOBS,
+        queue_size: int = consts.REPORTS_QUEUE_SIZE,
+        index: Optional[state_index.StateIndex] = None,
+    ) -> None:
+        self.results_base_dir = results_base_dir
+        self.web_base_dir = web_base_dir
+        self.java_heap = java_heap
+        self.jvm_cache_dir = jvm_cache_dir
+        self.history_keep = history_keep
+        self.compress_formats = tuple(compress_formats)
+        self.index = index
+        self.failed = 0
+
+        jobs = max(jobs, 1)
+        self._lock = threading.Lock()
+        web_jobs = max(web_jobs, 1)
+        # results that were submitted, but Allure is not done with them yet
+        self._slots = threading.BoundedSemaphore(jobs + max(queue_size, 0))
+        # generated reports that are not published yet
+        self._web_slots = threading.BoundedSemaphore(web_jobs + max(queue_size, 0))
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        self._web_executor = concurrent.futures.ThreadPoolExecutor(max_workers=web_jobs)
+        # old versions of reports are removed in the background
+        self._prune_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._in_progress: Dict[Path, concurrent.futures.Future] = {}
+        # resolved on the first report, so nothing is spawned when there's nothing to publish
+        self._allure_version: Optional[str] = None
+
+    def wait_for(self, results_dir: Path) -> None:
+        """Wait until report from the results dir is published, so the dir can be reused."""
+        future = self._in_progress.pop(results_dir, None)
+        if future:
+            concurrent.futures.wait([future])
+
+    def _set_failed(self, results_dir: Path) -> None:
+        # the sources are not marked as published, so they are retried next time
+        with self._lock:
+            self.failed += 1
+        LOGGER.exception(f"Failed to generate report from '{results_dir}'")
+
+    def _get_allure_version(self) -> str:
+        with self._lock:
+            if self._allure_version is None:
+                self._allure_version = get_allure_version()
+            return self._allure_version
+
+    def _get_cds_archive(self, allure_version: str) -> Optional[Path]:
+        if not self.jvm_cache_dir:
+            return None
+        return get_cds_archive(cache_dir=self.jvm_cache_dir, allure_version=allure_version)
+
+    def _set_published(self, sources: Iterable[Path]) -> None:
+        for results_path in sources:
+            (results_path.parent / consts.REPORT_PUBLISHED_SFILE).touch()
+            if self.index:
+                self.index.mark_published(results_path=results_path)
+
+    def _generate(
+        self, results_dir: Path, sources: List[Path], done: concurrent.futures.Future
+    ) -> None:
+        try:
+            allure_version = self._get_allure_version()
+            build = build_report(
+                results_base_dir=self.results_base_dir,
+                results_dir=results_dir,
+                web_base_dir=self.web_base_dir,
+                java_heap=self.java_heap,
+                cds_archive=self._get_cds_archive(allure_version=allure_version),
+                allure_version=allure_version,
+            )
+        except Exception:
+            self._set_failed(results_dir=results_dir)
+            done.set_result(None)
+            return
+        finally:
+            self._slots.release()
+
+        if build is None:
+            self._set_published(sources=sources)
+            done.set_result(None)
+            return
+
+        # wait while too many generated reports are waiting to be published
+        self._web_slots.acquire()
+        self._web_executor.submit(self._finish, results_dir, sources, build, done)
+
+    def _finish(
+        self,
+        results_dir: Path,
+        sources: List[Path],
+        build: ReportBuild,
+        done: concurrent.futures.Future,
+    ) -> None:
+        try:
+            web_dir = finish_report(
+                build=build,
+                web_base_dir=self.web_base_dir,
+                history_keep=self.history_keep,
+                compress_formats=self.compress_formats,
+            )
+        except Exception:
+            self._set_failed(results_dir=results_dir)
+        else:
+            LOGGER.info(f"Generated report: {web_dir}")
+            self._set_published(sources=sources)
+            self._prune_executor.submit(prune_report_versions, web_dir=web_dir)
+        finally:
+            self._web_slots.release()
+            done.set_result(None)
+
+    def submit(self, results_dir: Path, sources: Iterable[Path] = ()) -> None:
+        """Schedule generation of report, mark the `sources` as published along with it."""
+        # each report builds on the history of the previous one with the same destination
+        self.wait_for(results_dir=results_dir)
+        # don't stage results too far ahead of Allure
+        self._slots.acquire()
+        done: concurrent.futures.Future = concurrent.futures.Future()
+        self._in_progress[results_dir] = done
+        self._executor.submit(self._generate, results_dir, list(sources), done)
+
+    def shutdown(self) -> int:
+        """Wait for all reports to be published, return number of failed reports."""
+        self._executor.shutdown()
+        # all the generated reports were already handed over
+        self._web_executor.shutdown()
+        self._prune_executor.shutdown()
+        self._in_progress.clear()
+        # attachments of the pruned reports are no longer needed
+        attachment_store.collect_garbage(
+            store_dir=attachment_store.get_store_dir(web_base_dir=self.web_base_dir)
+        )
+        return self.failed
 
 
-def get_title_from_job(job: Job) -> str:
+def get_title_from_job(job: job_paths.Job) -> str:
     """Get title string from `Job`, skipping empty components."""
     parts = [job.revision or job.job_name, job.step]
     title = "/".join(p for p in parts if p)
@@ -101,23 +222,22 @@ def get_title_from_job(job: Job) -> str:
 
 
 def get_new_results(base_dir: Path) -> Generator[Path, None, None]:
-    """Walk new results directories and yield each set of results."""
-    for p in base_dir.rglob(consts.REPORT_DOWNLOADED_SFILE):
-        if (p.parent / consts.REPORT_PUBLISHED_SFILE).exists():
-            continue
+    """Yield each set of new results recorded in the state index."""
+    index = state_index.StateIndex(base_dir=base_dir)
+    for dest_dir in index.get_new_results():
+        result_path = job_paths.get_results_path(dest_dir=dest_dir)
 
-        result_file = p.parent / consts.REPORTS_ARCHIVE
-        if result_file.is_file():
-            yield result_file
+        if (dest_dir / consts.REPORT_PUBLISHED_SFILE).exists():
+            index.mark_published(results_path=result_path)
+            continue
 
-        result_dir = p.parent / consts.REPORTS_DIRNAME
-        if result_dir.is_dir():
-            yield result_dir
+        if result_path.exists():
+            yield result_path
 
 
-def unpack_results_archive(archive_file: Path) -> Path:
-    """Unpack the result archive."""
-    results_dir = archive_file.parent
+def unpack_results_archive(archive_file: Path, dest_dir: Optional[Path] = None) -> Path:
+    """Unpack the result archive (to the archive's dir by default)."""
+    results_dir = dest_dir or archive_file.parent
 
     with tarfile.open(archive_file, "r:xz") as tar:
         tar.extractall(path=results_dir)
@@ -126,72 +246,148 @@ def unpack_results_archive(archive_file: Path) -> Path:
     return unpacked_dir
 
 
-def get_results(new_results_base_dir: Path, out_dir: Path) -> Generator[Path, None, None]:
-    """Copy/unpack/clean new results."""
-    for cur_results in sorted(get_new_results(base_dir=new_results_base_dir)):
-        results_dir = cur_results
-        extracted_dir = None
-        if cur_results.name == consts.REPORTS_ARCHIVE:
-            results_dir = unpack_results_archive(archive_file=cur_results)
-            extracted_dir = results_dir
+def get_results_dest_dir(job_rec: job_paths.Job, out_dir: Path) -> Path:
+    """Return `Job`-derived dir where results are stored."""
+    dest_dir = out_dir / job_rec.job_name
+    if job_rec.revision:
+        dest_dir = dest_dir / job_rec.revision
+    if job_rec.step:
+        dest_dir = dest_dir / job_rec.step
+    return dest_dir
+
 
-        job_rec = get_job_from_results(results_path=cur_results, base_dir=new_results_base_dir)
+def stage_results(cur_results: Path, staging_dir: Path) -> Path:
+    """Unpack or copy results to the staging dir.
 
-        LOGGER.info(f"Processing {job_rec}")
+    Runs in a worker process.
+    """
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    staging_dir.mkdir(parents=True)
+
+    if cur_results.name == consts.REPORTS_ARCHIVE:
+        unpacked_dir = unpack_results_archive(archive_file=cur_results, dest_dir=staging_dir)
+    else:
+        unpacked_dir = staging_dir / consts.REPORTS_DIRNAME
+        fileops.copytree(cur_results, unpacked_dir)
+        if (cur_results.parent / consts.REPORTS_ARCHIVE).is_file():
+            # results were unpacked while downloading, the archive is kept for the record
+            shutil.rmtree(cur_results, ignore_errors=True)
 
-        dest_dir = out_dir / job_rec.job_name
-        if job_rec.revision:
-            dest_dir = dest_dir / job_rec.revision
-        if job_rec.step:
-            dest_dir = dest_dir / job_rec.step
+    return unpacked_dir
 
-        shutil.rmtree(dest_dir, ignore_errors=True)
-        dest_dir.mkdir(parents=True)
-        shutil.copytree(results_dir, dest_dir, symlinks=True, dirs_exist_ok=True)
 
-        # delete extracted files
-        if extracted_dir:
-            shutil.rmtree(extracted_dir, ignore_errors=True)
+def interleave_jobs(results: Iterable[Path], base_dir: Path) -> List[Path]:
+    """Reorder results so that builds of different jobs alternate.
 
-        (cur_results.parent / consts.REPORT_PUBLISHED_SFILE).touch()
+    Builds of the same job keep their order. Reports of consecutive results can then be
+    generated in parallel, as they don't depend on each other.
+    """
+    per_job: Dict[job_paths.Job, Deque[Path]] = {}
+    for result_path in results:
+        job_rec = job_paths.get_job_from_results(results_path=result_path, base_dir=base_dir)
+        per_job.setdefault(job_rec._replace(build_id=""), collections.deque()).append(result_path)
 
-        yield dest_dir
+    interleaved = []
+    while per_job:
+        for job_rec, job_results in list(per_job.items()):
+            interleaved.append(job_results.popleft())
+            if not job_results:
+                del per_job[job_rec]
+    return interleaved
 
 
-def aggregate_testrun(results_dirs: Iterable[Path], out_dir: Path) -> List[Path]:
+def get_results(
+    new_results_base_dir: Path,
+    out_dir: Path,
+    jobs: int = consts.STAGING_JOBS,
+    wait_for: Optional[Callable[[Path], None]] = None,
+) -> Generator[StagedResults, None, None]:
+    """Copy/unpack/clean new results."""
+    new_results = interleave_jobs(
+        results=sorted(get_new_results(base_dir=new_results_base_dir)),
+        base_dir=new_results_base_dir,
+    )
+    staging_base = out_dir / ".staging"
+    jobs = max(jobs, 1)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures: Deque[Tuple[Path, concurrent.futures.Future]] = collections.deque()
+        results_iter = enumerate(new_results)
+
+        def _submit_next() -> None:
+            next_results = next(results_iter, None)
+            if next_results is None:
+                return
+            num, cur_results = next_results
+            future = executor.submit(
+                stage_results, cur_results=cur_results, staging_dir=staging_base / str(num)
+            )
+            futures.append((cur_results, future))
+
+        # keep the workers busy, but don't stage too far ahead of the consumer
+        for __ in range(jobs * 2):
+            _submit_next()
+
+        while futures:
+            cur_results, future = futures.popleft()
+            unpacked_dir = future.result()
+            _submit_next()
+
+            job_rec = job_paths.get_job_from_results(
+                results_path=cur_results, base_dir=new_results_base_dir
+            )
+            LOGGER.info(f"Processing {job_rec}")
+
+            # moved to the `Job`-derived dir only now, so builds of the same job stay in order
+            dest_dir = get_results_dest_dir(job_rec=job_rec, out_dir=out_dir)
+            if wait_for:
+                # the consumer may still be processing the previous results in the dir
+                wait_for(dest_dir)
+            shutil.rmtree(dest_dir, ignore_errors=True)
+            dest_dir.parent.mkdir(parents=True, exist_ok=True)
+            unpacked_dir.rename(dest_dir)
+            shutil.rmtree(unpacked_dir.parent, ignore_errors=True)
+
+            # marking the results as published is left to the consumer
+            yield StagedResults(results_dir=dest_dir, sources=[cur_results])
+
+    shutil.rmtree(staging_base, ignore_errors=True)
+
+
+def aggregate_testrun(results_dirs: Iterable[StagedResults], out_dir: Path) -> List[StagedResults]:
     """Aggregate new results from the same testrun (job)."""
     mixed_results = out_dir / "mixed_results"
     shutil.rmtree(mixed_results, ignore_errors=True)
     mixed_results.mkdir(parents=True, exist_ok=True)
 
-    dest_dirs = set()
-    for results_dir in results_dirs:
-        job_rec = get_job_from_tree(inner_dir=results_dir, base_dir=out_dir)
+    dest_dirs: Dict[Path, List[Path]] = {}
+    for staged in results_dirs:
+        job_rec = job_paths.get_job_from_tree(inner_dir=staged.results_dir, base_dir=out_dir)
 
         LOGGER.info(f"Aggregating {job_rec}")
 
-        dest_dir = mixed_results / job_rec.job_name
-        if job_rec.revision:
-            dest_dir = dest_dir / job_rec.revision
-        if job_rec.step:
-            dest_dir = dest_dir / job_rec.step
+        dest_dir = get_results_dest_dir(job_rec=job_rec, out_dir=mixed_results)
 
         dest_dir.mkdir(parents=True, exist_ok=True)
-        shutil.copytree(results_dir, dest_dir, symlinks=True, dirs_exist_ok=True)
-        dest_dirs.add(dest_dir)
+        fileops.copytree(staged.results_dir, dest_dir, dirs_exist_ok=True)
+        dest_dirs.setdefault(dest_dir, []).extend(staged.sources)
 
-    return list(dest_dirs)
+    return [StagedResults(results_dir=d, sources=s) for d, s in dest_dirs.items()]
 
 
-def gen_badge_endpoint(report_dir: Path) -> Path:
-    """Generate endpoint for shields.io badge."""
+def gen_badge_endpoint(report_dir: Path, statistic: Optional[Dict[str, int]] = None) -> Path:
+    """Generate endpoint for shields.io badge.
+
+    Use the given statistic, or the statistic from summary generated by Allure.
+    """
     summary_json = report_dir / "widgets" / "summary.json"
     badge_json = report_dir / "badge.json"
 
-    with open(summary_json, encoding="utf-8") as in_fp:
-        summary = json.load(in_fp)
+    if statistic is None:
+        with open(summary_json, encoding="utf-8") as in_fp:
+            summary = json.load(in_fp)
+        statistic = summary.get("statistic") or {}
 
-    statistic = summary.get("statistic") or {}
     passed = statistic.get("passed") or 0
     failed = statistic.get("failed") or 0
     broken = statistic.get("broken") or 0
@@ -209,87 +405,215 @@ def gen_badge_endpoint(report_dir: Path) -> Path:
     return badge_json
 
 
-def copy_history(prev_report_dir: Path, results_dir: Path) -> None:
-    """Copy history files from previous report to results dir."""
-    history_dir = prev_report_dir / "history"
-    if not history_dir.is_dir():
-        return
-
-    shutil.rmtree(results_dir / "history", ignore_errors=True)
-    shutil.copytree(history_dir, results_dir / "history", symlinks=True)
-
-
-def get_teardown_failures(results_dir: Path) -> Set[str]:
-    """Get tests with teardown failures."""
-    teardown_failures: Set[str] = set()
-
-    for container_json in results_dir.glob("*-container.json"):
-        with open(container_json, encoding="utf-8") as in_fp:
-            result = json.load(in_fp)
-
-        for after in result.get("afters", []):
-            if after.get("status") in ("failed", "broken"):
-                teardown_failures.update(result.get("children"))
-
-    return teardown_failures
-
-
-def overwrite_statuses(results_dir: Path) -> None:
+def overwrite_statuses(
+    results_dir: Path, index: Optional[results_index.ResultsIndex] = None
+) -> results_index.ResultsIndex:
     """Overwrite selected test statuses.
 
     broken -> failed
     XFAIL skipped -> broken
     XFAIL skipped + teardown failure -> failed
     """
-    teardown_failures = get_teardown_failures(results_dir=results_dir)
+    index = index or results_index.build_index(results_dir=results_dir)
 
-    for result_json in results_dir.glob("*-result.json"):
-        overwrite = False
+    for result_rec in index.results.values():
+        new_status = results_index.get_new_status(result=result_rec, index=index)
+        if new_status == result_rec.status:
+            continue
 
-        with open(result_json, encoding="utf-8") as in_fp:
+        with open(result_rec.path, encoding="utf-8") as in_fp:
             result = json.load(in_fp)
+        result["status"] = new_status
+        # the file can be hardlinked to the original results, don't modify it in place
+        fileops.write_text(path=result_rec.path, text=json.dumps(result))
 
-        if result["status"] == "skipped" and result.get("statusDetails", {}).get(
-            "message", ""
-        ).startswith("XFAIL"):
-            result["status"] = "failed" if result["uuid"] in teardown_failures else "broken"
-            overwrite = True
-        elif result["status"] == "broken":
-            result["status"] = "failed"
-            overwrite = True
+    return index
 
-        if overwrite:
-            with open(result_json, "w", encoding="utf-8") as out_fp:
-                json.dump(result, out_fp)
 
-
-def generate_report(
-    results_base_dir: Path, results_dir: Path, reports_work_dir: Path, web_base_dir: Path
-) -> Path:
-    """Generate report from stored results."""
-    job_rec = get_job_from_tree(inner_dir=results_dir, base_dir=results_base_dir)
+def get_web_dest_dir(job_rec: job_paths.Job, web_base_dir: Path) -> Path:
+    """Return `Job`-derived dir where report is published."""
     dest_path_parts = [job_rec.job_name]
     if job_rec.revision:
         dest_path_parts.append(job_rec.revision)
     if job_rec.step:
         dest_path_parts.append(job_rec.step)
+    return Path(*web_base_dir.parts, *dest_path_parts)
 
-    report_dir = Path(*reports_work_dir.parts, *dest_path_parts)
-    web_dir = Path(*web_base_dir.parts, *dest_path_parts)
 
-    # make clean temporary directory for generated report
-    shutil.rmtree(report_dir, ignore_errors=True)
-    report_dir.mkdir(parents=True)
+def get_history_dir(job_rec: job_paths.Job, web_base_dir: Path) -> Path:
+    """Return `Job`-derived dir where history of the report is stored."""
+    return get_web_dest_dir(
+        job_rec=job_rec, web_base_dir=web_base_dir / consts.HISTORY_STORE_DIRNAME
+    )
 
-    # copy history files from last published report
-    copy_history(prev_report_dir=web_dir, results_dir=results_dir)
 
-    # overwrite selected statuses
-    overwrite_statuses(results_dir=results_dir)
+def get_report_version_dir(web_dir: Path) -> Path:
+    """Return new versioned dir for a report, next to the web dir."""
+    return web_dir.parent / f".{web_dir.name}.v{time.time_ns()}"
+
+
+def get_report_versions(web_dir: Path) -> List[Path]:
+    """Return all versioned dirs of a report, from the oldest to the newest."""
+    return sorted(web_dir.parent.glob(f".{web_dir.name}.v*"))
+
+
+def switch_report_version(web_dir: Path, version_dir: Path) -> None:
+    """Make the versioned report dir live by atomically replacing the web dir symlink."""
+    tmp_link = web_dir.parent / f".{web_dir.name}.link"
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(version_dir.name, target_is_directory=True)
+
+    # report published by an older version of this tool is a regular dir, make it
+    # an old version, so it is pruned later
+    if web_dir.is_dir() and not web_dir.is_symlink():
+        web_dir.rename(get_report_version_dir(web_dir=web_dir))
+
+    tmp_link.replace(web_dir)
+
+
+def prune_report_versions(web_dir: Path, keep: int = consts.REPORT_VERSIONS_KEEP) -> None:
+    """Delete old versions of a report, keep the live one and `keep - 1` newest other ones.
+
+    Readers that are still reading the previous version of the report are not affected.
+    """
+    live_dir = web_dir.resolve()
+    old_versions = [v for v in get_report_versions(web_dir=web_dir) if v.resolve() != live_dir]
+    for version_dir in old_versions[: max(len(old_versions) - keep + 1, 0)]:
+        LOGGER.debug(f"Removing old report version: {version_dir}")
+        shutil.rmtree(version_dir, ignore_errors=True)
+
+
+def get_allure_version() -> str:
+    """Return version of the Allure CLI."""
+    stdout, __ = cli(cli_args=["allure", "--version"])
+    return stdout.strip()
+
+
+def get_tree_digest(base_dir: Path, exclude: Iterable[str] = ()) -> str:
+    """Return digest of names and contents of all files in the dir tree.
+
+    Top-level entries listed in `exclude` are skipped.
+    """
+    if not base_dir.is_dir():
+        return ""
+
+    exclude = set(exclude)
+    tree_hash = hashlib.sha256()
+    for file in sorted(base_dir.rglob("*")):
+        rel_path = file.relative_to(base_dir)
+        if rel_path.parts[0] in exclude or not file.is_file():
+            continue
+
+        file_digest = fileops.get_file_digest(path=file)
+        tree_hash.update(f"{rel_path}\0{file_digest}\n".encode())
+
+    return tree_hash.hexdigest()
+
+
+def get_report_inputs(results_dir: Path, title: str, allure_version: str) -> Dict[str, str]:
+    """Return hashes of inputs the report is generated from."""
+    return {
+        "allure_version": allure_version,
+        "title": title,
+        "results": get_tree_digest(base_dir=results_dir, exclude=["history"]),
+    }
+
+
+def is_report_current(web_dir: Path, history_dir: Path, inputs: Dict[str, str]) -> bool:
+    """Check if the published report was generated from the same inputs.
+
+    The stored history must also be unchanged since the report was generated, otherwise
+    the published report would be missing history.
+    """
+    inputs_file = web_dir / consts.REPORT_INPUTS_FILE
+    try:
+        with open(inputs_file, encoding="utf-8") as in_fp:
+            published_inputs: Dict[str, Any] = json.load(in_fp)
+    except (OSError, ValueError):
+        return False
+
+    if any(published_inputs.get(k) != v for k, v in inputs.items()):
+        return False
+    return published_inputs.get("history") == get_tree_digest(base_dir=history_dir)
+
+
+def get_cds_archive(cache_dir: Path, allure_version: str) -> Path:
+    """Return path to the JVM class data sharing archive for the Allure version."""
+    return cache_dir / f"allure-{allure_version}.jsa"
+
+
+@contextlib.contextmanager
+def allure_env(
+    java_heap: str = consts.ALLURE_HEAP, cds_archive: Optional[Path] = None
+) -> Generator[Dict[str, str], None, None]:
+    """Return environment for running the Allure CLI."""
+    java_opts = [os.environ.get("JAVA_OPTS", "")]
+    if java_heap:
+        java_opts.append(f"-Xmx{java_heap}")
+    tmp_archive = None
+
+    # Allure generates a single report per run, the JVM startup is amortised using AppCDS;
+    # a stale or incompatible archive, or an unsupported option, is ignored by the JVM
+    if cds_archive:
+        java_opts.append("-XX:+IgnoreUnrecognizedVMOptions")
+        if cds_archive.exists():
+            java_opts.append(f"-XX:SharedArchiveFile={cds_archive}")
+        else:
+            cds_archive.parent.mkdir(parents=True, exist_ok=True)
+        # only one of the concurrently running JVMs creates the archive
+        if not cds_archive.exists() and _CDS_LOCK.acquire(blocking=False):
+            tmp_archive = cds_archive.with_name(f".{cds_archive.name}.{os.getpid()}")
+            java_opts.append(f"-XX:ArchiveClassesAtExit={tmp_archive}")
+
+    try:
+        yield {**os.environ, "JAVA_OPTS": " ".join(java_opts).strip()}
+        if cds_archive and tmp_archive and tmp_archive.exists():
+            tmp_archive.replace(cds_archive)
+            LOGGER.info(f"Created JVM class data sharing archive: {cds_archive}")
+    finally:
+        if tmp_archive:
+            tmp_archive.unlink(missing_ok=True)
+            _CDS_LOCK.release()
+
+
+def build_report(
+    results_base_dir: Path,
+    results_dir: Path,
+    web_base_dir: Path,
+    java_heap: str = consts.ALLURE_HEAP,
+    cds_archive: Optional[Path] = None,
+    allure_version: Optional[str] = None,
+) -> Optional[ReportBuild]:
+    """Generate Allure report from stored results to a new versioned dir next to the web dir.
+
+    Return None when the published report is already up to date.
+    """
+    job_rec = job_paths.get_job_from_tree(inner_dir=results_dir, base_dir=results_base_dir)
+    web_dir = get_web_dest_dir(job_rec=job_rec, web_base_dir=web_base_dir)
+    history_dir = get_history_dir(job_rec=job_rec, web_base_dir=web_base_dir)
+    # reports published before the history store existed carry their own history
+    history_store.seed(history_dir=history_dir, prev_report_dir=web_dir)
 
     # get report title
     title = get_title_from_job(job=job_rec)
 
+    # skip the generation when the published report is already up to date
+    inputs = get_report_inputs(
+        results_dir=results_dir, title=title, allure_version=allure_version or get_allure_version()
+    )
+    if is_report_current(web_dir=web_dir, history_dir=history_dir, inputs=inputs):
+        LOGGER.info(f"Report is up to date: {web_dir}")
+        return None
+
+    report_dir = get_report_version_dir(web_dir=web_dir)
+    report_dir.mkdir(parents=True)
+
+    # make history of previous reports available to Allure
+    history_store.checkout(history_dir=history_dir, results_dir=results_dir)
+
+    # overwrite selected statuses
+    index = overwrite_statuses(results_dir=results_dir)
+
     # generate Allure report
     cli_args = [
         "allure",
@@ -301,42 +625,141 @@ def generate_report(
         title,
         "--clean",
     ]
-    cli(cli_args=cli_args)
+    try:
+        with allure_env(java_heap=java_heap, cds_archive=cds_archive) as env:
+            cli(cli_args=cli_args, env=env)
+        # generate badge endpoint
+        gen_badge_endpoint(
+            report_dir=report_dir, statistic=results_index.get_statistic(index=index)
+        )
+    except Exception:
+        shutil.rmtree(report_dir, ignore_errors=True)
+        raise
 
-    # generate badge endpoint
-    gen_badge_endpoint(report_dir=report_dir)
+    return ReportBuild(
+        web_dir=web_dir, report_dir=report_dir, history_dir=history_dir, inputs=inputs
+    )
 
-    shutil.rmtree(web_dir, ignore_errors=True)
-    web_dir.mkdir(parents=True)
-    shutil.copytree(report_dir, web_dir, symlinks=True, dirs_exist_ok=True)
 
-    return web_dir
+def finish_report(
+    build: ReportBuild,
+    web_base_dir: Path,
+    history_keep: int = consts.HISTORY_KEEP,
+    compress_formats: Iterable[str] = consts.PRECOMPRESS_FORMATS,
+) -> Path:
+    """Prepare the generated report for the web and publish it."""
+    report_dir = build.report_dir
+    staged_history_dir = None
+    try:
+        if compress_formats:
+            precompress.compress_dir(base_dir=report_dir, formats=compress_formats)
+        # share identical attachments (and their compressed siblings) with other reports
+        attachment_store.store_attachments(
+            attachments_dir=report_dir / "data" / "attachments",
+            store_dir=attachment_store.get_store_dir(web_base_dir=web_base_dir),
+        )
+        staged_history_dir = history_store.stage(
+            history_dir=build.history_dir, report_dir=report_dir, keep=history_keep
+        )
+        inputs = {
+            **build.inputs,
+            "history": get_tree_digest(base_dir=staged_history_dir or build.history_dir),
+        }
+        fileops.write_text(
+            path=report_dir / consts.REPORT_INPUTS_FILE, text=json.dumps(inputs, indent=2)
+        )
+        # readers never see a partially written report
+        switch_report_version(web_dir=build.web_dir, version_dir=report_dir)
+    except Exception:
+        shutil.rmtree(report_dir, ignore_errors=True)
+        if staged_history_dir:
+            shutil.rmtree(staged_history_dir, ignore_errors=True)
+        raise
+
+    # the history store is updated only once the report is published
+    if staged_history_dir:
+        history_store.commit(history_dir=build.history_dir, staged_dir=staged_history_dir)
+
+    return build.web_dir
+
+
+def generate_report(
+    results_base_dir: Path,
+    results_dir: Path,
+    web_base_dir: Path,
+    java_heap: str = consts.ALLURE_HEAP,
+    cds_archive: Optional[Path] = None,
+    history_keep: int = consts.HISTORY_KEEP,
+    compress_formats: Iterable[str] = consts.PRECOMPRESS_FORMATS,
+) -> Path:
+    """Generate report from stored results and publish it to the web dir."""
+    build = build_report(
+        results_base_dir=results_base_dir,
+        results_dir=results_dir,
+        web_base_dir=web_base_dir,
+        java_heap=java_heap,
+        cds_archive=cds_archive,
+    )
+    if build is None:
+        job_rec = job_paths.get_job_from_tree(inner_dir=results_dir, base_dir=results_base_dir)
+        return get_web_dest_dir(job_rec=job_rec, web_base_dir=web_base_dir)
+
+    return finish_report(
+        build=build,
+        web_base_dir=web_base_dir,
+        history_keep=history_keep,
+        compress_formats=compress_formats,
+    )
 
 
 def publish(
     new_results_base_dir: Path,
     web_base_dir: Path,
     results_tmp_dir: Path,
-    reports_tmp_dir: Path,
     aggregate_results: bool = False,
+    staging_jobs: int = consts.STAGING_JOBS,
+    allure_jobs: int = consts.ALLURE_JOBS,
+    java_heap: str = consts.ALLURE_HEAP,
+    jvm_cache_dir: Optional[Path] = None,
+    history_keep: int = consts.HISTORY_KEEP,
+    compress_formats: Iterable[str] = consts.PRECOMPRESS_FORMATS,
+    web_jobs: int = consts.WEB_JOBS,
+    queue_size: int = consts.REPORTS_QUEUE_SIZE,
 ) -> None:
     """Publish reports to the web."""
     # tmp dir where unpacked / aggregated results are stored
     results_tmp_dir.mkdir(parents=True, exist_ok=True)
-    # temp dir where reports are generated before moving to the web dir
-    reports_tmp_dir.mkdir(parents=True, exist_ok=True)
 
-    results_dirs: Iterable[Path] = get_results(
-        new_results_base_dir=new_results_base_dir, out_dir=results_tmp_dir
+    # staging, Allure generation and publishing overlap, each on its own pool of workers
+    scheduler = ReportScheduler(
+        results_base_dir=results_tmp_dir,
+        web_base_dir=web_base_dir,
+        jobs=allure_jobs,
+        java_heap=java_heap,
+        jvm_cache_dir=jvm_cache_dir,
+        history_keep=history_keep,
+        compress_formats=compress_formats,
+        web_jobs=web_jobs,
+        queue_size=queue_size,
+        index=state_index.StateIndex(base_dir=new_results_base_dir),
     )
-    if aggregate_results:
-        results_dirs = aggregate_testrun(results_dirs=results_dirs, out_dir=results_tmp_dir)
-
-    for results_dir in results_dirs:
-        web_dir = generate_report(
-            results_base_dir=results_tmp_dir,
-            results_dir=results_dir,
-            reports_work_dir=reports_tmp_dir,
-            web_base_dir=web_base_dir,
+
+    try:
+        results_dirs: Iterable[StagedResults] = get_results(
+            new_results_base_dir=new_results_base_dir,
+            out_dir=results_tmp_dir,
+            jobs=staging_jobs,
+            wait_for=scheduler.wait_for,
         )
-        LOGGER.info(f"Generated report: {web_dir}")
+        if aggregate_results:
+            # reports are generated only once all the results are aggregated
+            results_dirs = aggregate_testrun(results_dirs=results_dirs, out_dir=results_tmp_dir)
+
+        for staged in results_dirs:
+            scheduler.submit(results_dir=staged.results_dir, sources=staged.sources)
+    finally:
+        failed = scheduler.shutdown()
+
+    if failed:
+        err = f"Failed to generate {failed} report(s)."
+        raise RuntimeError(err)
@@ -0,0 +1,149 @@
+"""Keep Github API requests within the rate limits."""
+
+import http
+import logging
+import threading
+import time
+from typing import Any
+from typing import Optional
+
+import requests
+import requests.adapters
+
+from report_aggregator import consts
+
+LOGGER = logging.getLogger(__name__)
+
+RATE_LIMIT_STATUSES = (http.HTTPStatus.FORBIDDEN, http.HTTPStatus.TOO_MANY_REQUESTS)
+
+
+class RateLimiter:
+    """Track the API rate limit budget and pace the requests accordingly."""
+
+    def __init__(
+        self, min_interval: float = consts.API_MIN_INTERVAL, reserve: int = consts.API_RESERVE
+    ) -> None:
+        self.min_interval = min_interval
+        self.reserve = reserve
+
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+        self.first_remaining: Optional[int] = None
+        self.requests_count = 0
+        self.rate_limited_count = 0
+        self.waited_secs = 0.0
+
+        self._next_request_at = 0.0
+        self._lock = threading.Lock()
+
+    def _get_delay(self, now: float) -> float:
+        delay = self._next_request_at - now
+        # while the budget is above `reserve`, requests are only spaced by `min_interval`
+        if self.remaining is None or self.remaining > self.reserve or self.reset_at <= now:
+            return delay
+
+        if self.remaining <= 0:
+            return max(delay, self.reset_at - now + 1)
+
+        # spread the remaining budget evenly until the reset
+        return max(delay, (self.reset_at - now) / self.remaining)
+
+    def wait(self) -> None:
+        """Wait until the next request is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self._get_delay(now=now), 0.0)
+            self._next_request_at = now + delay + self.min_interval
+            self.requests_count += 1
+            self.waited_secs += delay
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, secs: float) -> None:
+        """Pause all requests for the given number of seconds."""
+        with self._lock:
+            self._next_request_at = max(self._next_request_at, time.monotonic() + secs)
+
+    def update(self, response: requests.Response, attempt: int = 0) -> float:
+        """Update the budget from response headers.
+
+        Return number of seconds to wait before the request can be retried, or 0 if the
+        request didn't hit a rate limit.
+        """
+        headers = response.headers
+        remaining = headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            with self._lock:
+                self.remaining = int(remaining)
+                self.limit = int(headers.get("X-RateLimit-Limit") or 0) or self.limit
+                # the reset time is in epoch seconds, convert it to monotonic clock
+                reset_epoch = int(headers.get("X-RateLimit-Reset") or 0)
+                if reset_epoch:
+                    self.reset_at = time.monotonic() + max(reset_epoch - time.time(), 0)
+                if self.first_remaining is None:
+                    self.first_remaining = self.remaining
+
+        if response.status_code not in RATE_LIMIT_STATUSES:
+            return 0.0
+
+        retry_after = headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            backoff = float(retry_after)
+        elif remaining == "0":
+            backoff = max(self.reset_at - time.monotonic(), 0) + 1
+        elif "rate limit" in response.text.lower():
+            # secondary rate limit without further info, back off exponentially
+            backoff = consts.API_SECONDARY_BACKOFF * 2**attempt
+        else:
+            # 403 unrelated to rate limits
+            return 0.0
+
+        with self._lock:
+            self.rate_limited_count += 1
+        # all the requests wait, not just the one that hit the limit
+        self.pause(secs=backoff)
+        return backoff
+
+    def log_usage(self) -> None:
+        """Log how much of the budget was used."""
+        used = ""
+        if self.first_remaining is not None and self.remaining is not None:
+            used = f", budget used: {max(self.first_remaining - self.remaining, 0)}"
+        low_budget = self.remaining is not None and self.remaining < self.reserve
+        # the requests were slowed down
+        level = logging.WARNING if self.rate_limited_count or low_budget else logging.INFO
+        LOGGER.log(
+            level,
+            f"API requests: {self.requests_count}{used}, "
+            f"remaining: {self.remaining}/{self.limit}, "
+            f"rate limited: {self.rate_limited_count}x, waited: {self.waited_secs:.1f}s",
+        )
+
+
+class RateLimitedAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter that sends Github API requests through the `RateLimiter`."""
+
+    def __init__(self, rate_limiter: RateLimiter, **kwargs: Any) -> None:
+        self.rate_limiter = rate_limiter
+        super().__init__(**kwargs)
+
+    def send(  # type: ignore[override]
+        self, request: requests.PreparedRequest, **kwargs: Any
+    ) -> requests.Response:
+        # e.g. the blob storage the artifacts are redirected to
+        if not (request.url or "").startswith(consts.API_URL):
+            return super().send(request, **kwargs)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.wait()
+            response = super().send(request, **kwargs)
+            backoff = self.rate_limiter.update(response=response, attempt=attempt)
+            if not backoff or attempt >= consts.HTTP_RETRIES:
+                return response
+
+            LOGGER.warning(f"Rate limit hit, retrying in {backoff:.0f}s: {request.url}")
+            response.close()
+            attempt += 1
@@ -3,15 +3,17 @@
 import datetime
 import logging
 from pathlib import Path
+from typing import Any
+from typing import Dict
 from typing import Generator
-
-import github
-from github import Repository as GRepository
-from github import Workflow as GWorkflow
-from github import WorkflowRun as GWorkflowRun
+from typing import List
+from typing import Tuple
 
 from report_aggregator import artifacts_github
 from report_aggregator import consts
+from report_aggregator import discovery
+from report_aggregator import github_api
+from report_aggregator import state_index
 
 LOGGER = logging.getLogger(__name__)
 
@@ -25,25 +27,35 @@ def get_slug(name: str) -> str:
 
 
 def get_workflows(
-    repo_obj: GRepository.Repository,
-) -> Generator[GWorkflow.Workflow, None, None]:
+    api: github_api.GithubApi, repo_slug: str
+) -> Generator[Dict[str, Any], None, None]:
     """Return active regression workflows."""
-    workflows = (w for w in repo_obj.get_workflows() if NAME_BASE in w.name and w.state == "active")
+    workflows = (
+        w
+        for w in api.get_paginated(url=f"repos/{repo_slug}/actions/workflows", key="workflows")
+        if NAME_BASE in w["name"] and w["state"] == "active"
+    )
     return workflows
 
 
 def get_runs(
-    workflow: GWorkflow.Workflow, testrun_name: str, started_from: datetime.datetime
-) -> Generator[GWorkflowRun.WorkflowRun, None, None]:
-    """Return recent runs for a workflow."""
-    for r in workflow.get_runs(event="workflow_dispatch", status="completed"):
-        if r.created_at < started_from:
-            return
-
-        if f"Run: {testrun_name}" not in r.raw_data["name"]:
-            continue
-
-        if ":repeat:" not in r.raw_data["name"]:
+    api: github_api.GithubApi,
+    workflow: Dict[str, Any],
+    testrun_name: str,
+    started_from: datetime.datetime,
+) -> Generator[Dict[str, Any], None, None]:
+    """Return recent runs of the testrun for a workflow.
+
+    The runs are looked up in the local index of workflow runs, which is updated
+    incrementally.
+    """
+    for r in api.get_indexed_runs(
+        url=f"{workflow['url']}/runs",
+        created_from=started_from,
+        params={"event": "workflow_dispatch"},
+        name_contains=f"Run: {testrun_name}",
+    ):
+        if ":repeat:" not in r["name"]:
             # this is the first full testrun, no need to look further
             yield r
             return
@@ -51,59 +63,121 @@ def get_runs(
         yield r
 
 
+def find_testrun_runs(
+    api: github_api.GithubApi,
+    repo_slug: str,
+    testrun_name: str,
+    started_from: datetime.datetime,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Return the first workflow with runs of the testrun, together with the runs."""
+    for workflow in get_workflows(api=api, repo_slug=repo_slug):
+        runs = list(
+            get_runs(
+                api=api, workflow=workflow, testrun_name=testrun_name, started_from=started_from
+            )
+        )
+        # the workflow with matching runs was found, no need to search in other workflows
+        if runs:
+            return workflow, runs
+    return {}, []
+
+
+def get_artifact_tasks(
+    api: github_api.GithubApi,
+    repo_slug: str,
+    base_dir: Path,
+    testrun_name: str,
+    started_from: datetime.datetime,
+) -> Generator[artifacts_github.ArtifactTask, None, None]:
+    """Return artifacts that need to be processed for the testrun.
+
+    The workflows are searched in order, and only the first workflow with matching runs is
+    used. Artifacts of its runs are listed concurrently.
+    """
+    workflow, runs = find_testrun_runs(
+        api=api, repo_slug=repo_slug, testrun_name=testrun_name, started_from=started_from
+    )
+    if not runs:
+        return
+
+    workflow_slug = get_slug(name=workflow["name"])
+    testrun_slug = get_slug(name=testrun_name)
+    base_dest_dir = base_dir / workflow_slug / testrun_slug
+    if not (base_dest_dir / "testrun_name.txt").exists():
+        base_dest_dir.mkdir(parents=True, exist_ok=True)
+        (base_dest_dir / "testrun_name.txt").write_text(testrun_name)
+
+    LOGGER.info(f"Processing workflow: {workflow['name']} ({workflow_slug})")
+
+    new_runs = []
+    for cur_run in runs:
+        if api.is_run_done(run_id=cur_run["id"]):
+            LOGGER.debug(f"Skipping already processed run: {cur_run['run_number']}")
+            continue
+        new_runs.append((workflow, cur_run))
+
+    for work_item in discovery.iter_run_artifacts(api=api, runs=new_runs):
+        cur_run = work_item.run
+        LOGGER.info(f"Processing run: {cur_run['run_number']}")
+
+        result_artifacts = list(
+            artifacts_github.get_result_artifacts(run_artifacts=work_item.artifacts)
+        )
+        has_steps = result_artifacts and ("step" in result_artifacts[0]["name"])
+
+        if len(result_artifacts) > 1 and not has_steps:
+            LOGGER.warning("Skipping run with unexpected artifacts")
+            api.mark_run_done(run_id=cur_run["id"])
+            continue
+
+        run_tasks = []
+        for artifact in result_artifacts:
+            dest_dir = base_dest_dir / str(cur_run["run_number"])
+            if has_steps:
+                step_id = artifacts_github.get_step_id(artifact_name=artifact["name"])
+                dest_dir = dest_dir / step_id
+
+            run_tasks.append(
+                artifacts_github.get_artifact_task(artifact=artifact, dest_dir=dest_dir)
+            )
+
+        # the run is done once all its artifacts were downloaded in some of the previous runs;
+        # it is marked only after the consumer had a chance to record them in the state index
+        is_done = all(artifacts_github.is_task_done(t) for t in run_tasks)
+        yield from run_tasks
+        if is_done:
+            api.mark_run_done(run_id=cur_run["id"])
+
+
 def download_testrun_results(
     base_dir: Path,
     testrun_name: str,
     repo_slug: str = consts.REPO_SLUG,
     timedelta_mins: int = SEARCH_PAST_MINS,
+    jobs: int = consts.DOWNLOAD_JOBS,
+    stream: bool = False,
 ) -> None:
     """Download results from all recent nightly jobs."""
-    github_obj = github.Github(auth=github.Auth.Token(consts.GITHUB_TOKEN))
-    repo_obj = github_obj.get_repo(repo_slug)
     started_from = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(
         minutes=timedelta_mins
     )
 
     LOGGER.info(f"Searching for run '{testrun_name}' since {started_from}")
-    workflow_found = False
-
-    for workflow in get_workflows(repo_obj=repo_obj):
-        workflow_slug = get_slug(name=workflow.name)
-        testrun_slug = get_slug(name=testrun_name)
-        base_dest_dir = base_dir / workflow_slug / testrun_slug
-        if not (base_dest_dir / "testrun_name.txt").exists():
-            base_dest_dir.mkdir(parents=True, exist_ok=True)
-            (base_dest_dir / "testrun_name.txt").write_text(testrun_name)
-
-        LOGGER.info(f"Processing workflow: {workflow.name} ({workflow_slug})")
-
-        for cur_run in get_runs(
-            workflow=workflow, testrun_name=testrun_name, started_from=started_from
-        ):
-            LOGGER.info(f"Processing run: {cur_run.run_number}")
-            workflow_found = True
-
-            run_artifacts = list(artifacts_github.get_run_artifacts(run=cur_run))
-            result_artifacts = list(
-                artifacts_github.get_result_artifacts(run_artifacts=run_artifacts)
-            )
-            has_steps = result_artifacts and ("step" in result_artifacts[0].name)
-
-            if len(result_artifacts) > 1 and not has_steps:
-                LOGGER.warning("Skipping run with unexpected artifacts")
-                continue
 
-            for artifact in result_artifacts:
-                dest_dir = base_dest_dir / str(cur_run.run_number)
-                if has_steps:
-                    step_id = artifact.name[len(consts.RESULTS_ARTIFACT_NAME) :].lstrip("-")
-                    dest_dir = dest_dir / step_id
-                dest_dir.mkdir(parents=True, exist_ok=True)
-
-                artifacts_github.process_result_artifact(
-                    dest_dir=dest_dir, download_url=artifact.archive_download_url
-                )
-
-        # the workflow with matching runs was found, no need to search in other workflows
-        if workflow_found:
-            break
+    with github_api.get_api(base_dir=base_dir) as api:
+        failed = artifacts_github.download_artifacts(
+            tasks=get_artifact_tasks(
+                api=api,
+                repo_slug=repo_slug,
+                base_dir=base_dir,
+                testrun_name=testrun_name,
+                started_from=started_from,
+            ),
+            jobs=jobs,
+            stream=stream,
+            index=state_index.StateIndex(base_dir=base_dir),
+        )
+    artifacts_github.get_rate_limiter().log_usage()
+    if failed:
+        err = f"Failed to process {failed} artifact(s)."
+        raise RuntimeError(err)
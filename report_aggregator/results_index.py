@@ -0,0 +1,117 @@
+"""In-memory index of Allure results, built in a single pass over the results dir."""
+
+import concurrent.futures
+import json
+import os
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Set
+from typing import Tuple
+
+try:
+    import orjson
+
+    def _loads(data: bytes) -> Any:
+        return orjson.loads(data)
+
+except ImportError:
+
+    def _loads(data: bytes) -> Any:
+        return json.loads(data)
+
+
+READ_JOBS = min(32, (os.cpu_count() or 1) + 4)
+
+FAILED_STATUSES = ("failed", "broken")
+BADGE_STATUSES = ("passed", "failed", "broken", "skipped", "unknown")
+
+
+class TestResult(NamedTuple):
+    uuid: str
+    status: str
+    history_id: str
+    stop: int
+    is_xfail: bool
+    path: Path
+
+
+class ResultsIndex(NamedTuple):
+    # uuid -> test result
+    results: Dict[str, TestResult]
+    # test uuid -> uuids of containers the test belongs to
+    containers: Dict[str, List[str]]
+    # uuids of tests with failed teardown
+    teardown_failures: Set[str]
+
+
+def _read_json(path: Path) -> Tuple[Path, Any]:
+    return path, _loads(path.read_bytes())
+
+
+def build_index(results_dir: Path, jobs: int = READ_JOBS) -> ResultsIndex:
+    """Read all result and container files, in parallel."""
+    index = ResultsIndex(results={}, containers={}, teardown_failures=set())
+
+    files = [
+        e.path
+        for e in os.scandir(results_dir)
+        if e.name.endswith(("-result.json", "-container.json")) and e.is_file()
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for path, data in executor.map(_read_json, map(Path, files), chunksize=64):
+            if path.name.endswith("-container.json"):
+                children = data.get("children") or []
+                for child in children:
+                    index.containers.setdefault(child, []).append(data.get("uuid", ""))
+                if any(a.get("status") in FAILED_STATUSES for a in data.get("afters") or []):
+                    index.teardown_failures.update(children)
+                continue
+
+            message = (data.get("statusDetails") or {}).get("message") or ""
+            uuid = data["uuid"]
+            index.results[uuid] = TestResult(
+                uuid=uuid,
+                status=data["status"],
+                history_id=data.get("historyId") or uuid,
+                stop=data.get("stop") or 0,
+                is_xfail=message.startswith("XFAIL"),
+                path=path,
+            )
+
+    return index
+
+
+def get_new_status(result: TestResult, index: ResultsIndex) -> str:
+    """Return status the test result is reported with.
+
+    broken -> failed
+    XFAIL skipped -> broken
+    XFAIL skipped + teardown failure -> failed
+    """
+    if result.status == "skipped" and result.is_xfail:
+        return "failed" if result.uuid in index.teardown_failures else "broken"
+    if result.status == "broken":
+        return "failed"
+    return result.status
+
+
+def get_statistic(index: ResultsIndex) -> Dict[str, int]:
+    """Return number of tests per status, like in the Allure summary.
+
+    Only the latest result of each test (retries share the `historyId`) is counted.
+    """
+    latest: Dict[str, TestResult] = {}
+    for result in index.results.values():
+        prev = latest.get(result.history_id)
+        if prev is None or result.stop >= prev.stop:
+            latest[result.history_id] = result
+
+    statistic = dict.fromkeys(BADGE_STATUSES, 0)
+    for result in latest.values():
+        status = get_new_status(result=result, index=index)
+        statistic[status] = statistic.get(status, 0) + 1
+    statistic["total"] = len(latest)
+    return statistic
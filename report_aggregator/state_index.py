@@ -0,0 +1,177 @@
+"""Persistent index of downloaded results and their publication state."""
+
+import contextlib
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import List
+
+from report_aggregator import consts
+from report_aggregator import job_paths
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = ".state_index.sqlite"
+
+KIND_RESULTS = "results"
+KIND_COVERAGE = "coverage"
+
+STATE_DOWNLOADED = "downloaded"
+STATE_PUBLISHED = "published"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    job_name TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    build_id TEXT NOT NULL,
+    step TEXT NOT NULL,
+    state TEXT NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_kind_state ON results (kind, state);
+CREATE INDEX IF NOT EXISTS results_kind_job ON results (kind, job_name);
+"""
+
+
+class StateIndex:
+    """Index of result sets stored in the results base dir, so the tree needn't be walked."""
+
+    def __init__(self, base_dir: Path) -> None:
+        self.base_dir = base_dir
+        self.db_file = base_dir / INDEX_FILE_NAME
+
+        is_new = not self.db_file.exists()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        if is_new:
+            self.rescan()
+
+    @contextlib.contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        with contextlib.closing(sqlite3.connect(str(self.db_file), timeout=60)) as conn, conn:
+            yield conn
+
+    def _get_row(self, results_path: Path, kind: str, state: str) -> tuple:
+        job = job_paths.get_job_from_results(results_path=results_path, base_dir=self.base_dir)
+        try:
+            mtime = results_path.stat().st_mtime
+        except FileNotFoundError:
+            mtime = time.time()
+        return (
+            str(results_path.relative_to(self.base_dir)),
+            kind,
+            job.job_name,
+            job.revision,
+            job.build_id,
+            job.step,
+            state,
+            mtime,
+        )
+
+    def _insert(self, rows: Iterable[tuple], replace: bool = True) -> None:
+        # without `replace`, existing rows (e.g. already published results) are kept as they are
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self._connect() as conn:
+            conn.executemany(
+                f"{verb} INTO results "
+                "(path, kind, job_name, revision, build_id, step, state, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def rescan(self) -> None:
+        """Rebuild the index from the marker files (e.g. after results were added manually)."""
+        LOGGER.info(f"Rebuilding state index '{self.db_file}'")
+        rows = []
+        for p in self.base_dir.rglob(consts.REPORT_DOWNLOADED_SFILE):
+            published = (p.parent / consts.REPORT_PUBLISHED_SFILE).exists()
+            rows.append(
+                self._get_row(
+                    results_path=job_paths.get_results_path(dest_dir=p.parent),
+                    kind=KIND_RESULTS,
+                    state=STATE_PUBLISHED if published else STATE_DOWNLOADED,
+                )
+            )
+        rows.extend(
+            self._get_row(
+                results_path=p.parent / consts.COV_FILE_NAME,
+                kind=KIND_COVERAGE,
+                state=STATE_DOWNLOADED,
+            )
+            for p in self.base_dir.rglob(consts.COV_DOWNLOADED_SFILE)
+        )
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
+        self._insert(rows=rows)
+
+    def record_results(self, dest_dir: Path, only_new: bool = False) -> None:
+        """Record downloaded results, keep the existing record if `only_new` is set."""
+        self._insert(
+            replace=not only_new,
+            rows=[
+                self._get_row(
+                    results_path=job_paths.get_results_path(dest_dir=dest_dir),
+                    kind=KIND_RESULTS,
+                    state=STATE_DOWNLOADED,
+                )
+            ],
+        )
+
+    def record_coverage(self, dest_dir: Path, only_new: bool = False) -> None:
+        """Record downloaded coverage file, keep the existing record if `only_new` is set."""
+        self._insert(
+            replace=not only_new,
+            rows=[
+                self._get_row(
+                    results_path=dest_dir / consts.COV_FILE_NAME,
+                    kind=KIND_COVERAGE,
+                    state=STATE_DOWNLOADED,
+                )
+            ],
+        )
+
+    def mark_published(self, results_path: Path) -> None:
+        """Record that the results were published."""
+        dest_dir = results_path.parent.relative_to(self.base_dir)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE results SET state = ? WHERE kind = ? AND path IN (?, ?)",
+                (
+                    STATE_PUBLISHED,
+                    KIND_RESULTS,
+                    str(dest_dir / consts.REPORTS_DIRNAME),
+                    str(dest_dir / consts.REPORTS_ARCHIVE),
+                ),
+            )
+
+    def get_new_results(self) -> List[Path]:
+        """Return dirs with results that were downloaded but not published yet."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT path FROM results WHERE kind = ? AND state = ? ORDER BY path",
+                (KIND_RESULTS, STATE_DOWNLOADED),
+            ).fetchall()
+        return [(self.base_dir / r[0]).parent for r in rows]
+
+    def get_latest_coverage(self, job_pattern: str, newer_than: float) -> List[Path]:
+        """Return the latest coverage file newer than `newer_than` for each matching job."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT job_name, path FROM results "
+                "WHERE kind = ? AND job_name GLOB ? AND mtime > ? "
+                "ORDER BY job_name, path DESC",
+                (KIND_COVERAGE, job_pattern, newer_than),
+            ).fetchall()
+
+        latest: Dict[str, Path] = {}
+        for job_name, path in rows:
+            latest.setdefault(job_name, self.base_dir / path)
+        return list(latest.values())